@@ -1,6 +1,7 @@
 from discord.ext import commands
 from cogs.utils import perms
 from cogs.utils import format as formatter
+from cogs.utils import cache
 import discord
 import inspect
 import asyncio
@@ -76,6 +77,44 @@ class Admin:
     sys.exit()
 
 
+  @commands.command(name='caches', hidden=True)
+  @perms.is_owner()
+  async def _caches(self):
+    """Shows size, hit rate and evictions of the bot's caches."""
+    if not cache.caches:
+      await self.bot.say('no caches in use')
+      return
+
+    out = ''
+    fmt = '{:<12} {:>7} {:>10} {:>6} {:>8} {:>8}\n'
+    out += fmt.format('name', 'entries', 'bytes', 'hit%', 'evicted', 'expired')
+    for name in sorted(cache.caches):
+      stats = cache.caches[name].stats()
+      out += fmt.format(name, stats['entries'], stats['bytes'],
+                        '{:.0%}'.format(stats['hit_rate']),
+                        stats['evictions'], stats['expired']
+      )
+    await self.bot.say(formatter.code(out[:-1]))
+
+  @commands.command(name='http', hidden=True)
+  @perms.is_owner()
+  async def _http(self):
+    """Shows requests, errors and time spent per host."""
+    metrics = self.bot.web.metrics
+    if not metrics:
+      await self.bot.say('no requests made yet')
+      return
+
+    out = ''
+    fmt = '{:<24} {:>6} {:>6} {:>10} {:>8}\n'
+    out += fmt.format('host', 'reqs', 'errors', 'bytes', 'avg ms')
+    for host in sorted(metrics, key=lambda h: -metrics[h]['requests']):
+      m = metrics[host]
+      out += fmt.format(host[:24], m['requests'], m['errors'], m['bytes'],
+                        int(1000 * m['seconds'] / m['requests'])
+      )
+    await self.bot.say(formatter.code(out[:-1]))
+
   @commands.command(pass_context=True, hidden=True)
   @perms.is_owner()
   async def debug(self, ctx, *, code : str):
@@ -16,6 +16,18 @@ class AZ:
   def __init__(self, bot):
     self.bot  = bot
     self.conf = Config('configs/az.json')
+    self.bot.loop.create_task(self.refresh_index())
+
+  async def refresh_index(self):
+    loop = self.bot.loop
+    while self == self.bot.get_cog('AZ'):
+      path = puush.conf.get('path')
+      if path and os.path.exists(path):
+        try:
+          await loop.run_in_executor(None, azfind.refresh, path)
+        except:
+          pass
+      await asyncio.sleep(self.conf.get('index_refresh', 300))
 
   @commands.command()
   async def lenny(self, first=''):
@@ -147,13 +159,42 @@ class AZ:
       )
       return
 
+    progress = {}
+    reporter = loop.create_task(self.report_progress(ctx.message.channel,
+                                                     progress
+    ))
     try:
-      future_url = loop.run_in_executor(None, puush.get_url, path)
+      future_url = loop.run_in_executor(None, puush.get_url, path,
+                       lambda done, total: progress.update(done=done,
+                                                           total=total)
+      )
       url = await future_url
     except:
       url = 'There was an error uploading the image, ' + \
             'but at least I didn\'t crash :p'
+    reporter.cancel()
+    if progress.get('message'):
+      try:
+        await self.bot.delete_message(progress['message'])
+      except:
+        pass
     await self.bot.say(url)
 
+  async def report_progress(self, channel, progress, delay=2):
+    shown = None
+    while True:
+      await asyncio.sleep(delay)
+      state = progress.get('done'), progress.get('total')
+      if not state[1] or state[1] < 2 or state == shown:
+        continue
+      text  = 'uploading... {}/{}'.format(*state)
+      shown = state
+      if progress.get('message'):
+        progress['message'] = await self.bot.edit_message(progress['message'],
+                                                          text
+        )
+      else:
+        progress['message'] = await self.bot.send_message(channel, text)
+
 def setup(bot):
   bot.add_cog(AZ(bot))
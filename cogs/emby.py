@@ -2,11 +2,13 @@
 
 from discord.ext import commands
 import cogs.utils.emby_helper as emby_helper
+import cogs.utils.emby_socket as emby_socket
 import cogs.utils.format as formatter
 import discord
 import asyncio
 import logging
 from embypy.objects import EmbyObject
+from cogs.utils.cache import LRUCache
 import re
 
 class Emby:
@@ -14,30 +16,93 @@ class Emby:
     self.bot  = bot
     self.conf = emby_helper.conf
     self.conn = emby_helper.conn
-    #self.conn.connector.set_on_message(self.on_socket_message)
     self.loop = self.bot.loop
+    self.connected = False
+    self.announced = LRUCache(max_entries=1000) # ids already notified about
+    self.index_watching()
+    if self.conf.get('websocket', True):
+      self.loop.create_task(self.listen())
     self.loop.create_task(self.poll())
 
+  async def listen(self):
+    """follow emby's LibraryChanged messages, poll only covers outages"""
+    url   = emby_socket.websocket_url(self.conf['address'], self.conf['auth'])
+    delay = 1
+    while self == self.bot.get_cog('Emby'):
+      try:
+        await emby_socket.follow(self.bot.web.session, url,
+                                 self.on_socket_message, self.on_socket_connect
+        )
+        delay = 1
+      except Exception as e:
+        logging.info('emby websocket: {}: {}'.format(type(e).__name__, e))
+      self.connected = False
+      await asyncio.sleep(delay)
+      delay = min(delay * 2, 60)
+
+  async def on_socket_connect(self):
+    # pick up anything added while disconnected, then stop polling
+    await self.check_latest()
+    self.connected = True
+
   async def poll(self):
     while self == self.bot.get_cog('Emby'):
-      latest = await self.loop.run_in_executor(None, self.conn.latest)
-      for l in latest:
-        if self.conf['watching']['last'] == l.id:
-          break
-        item = t = await self.loop.run_in_executor(None, l.update)
-        while t.parent_id:
-          t = t.parent
-          try:
-            chans = self.conf['watching'].get(t.id, [])
-            for chan_id in chans:
-              chan = self.bot.get_channel(chan_id)
-              em   = await emby_helper.makeEmbed(item, 'New item added: ')
-              await self.bot.send_message(chan, embed=em)
-          except:
-            break
+      if not self.connected:
+        await self.check_latest()
+      await asyncio.sleep(30)
+
+  async def check_latest(self):
+    latest = await self.loop.run_in_executor(None, self.conn.latest)
+    new    = []
+    for l in latest:
+      if self.conf['watching']['last'] == l.id:
+        break
+      new.append(l)
+
+    if new:
+      await self.announce(new)
+
+    if latest:
       self.conf['watching']['last'] = latest[0].id
       self.conf.save()
-      await asyncio.sleep(30)
+
+  async def announce(self, items, skip_folders=False):
+    try:
+      hydrated = await self.loop.run_in_executor(None, emby_helper.hydrate,
+                                                 items
+      )
+    except Exception as e:
+      logging.info('emby hydrate: {}: {}'.format(type(e).__name__, e))
+      return
+    for item, ancestors in hydrated:
+      emby_helper.invalidate(item.id)
+      if item.id in self.announced:
+        continue
+      if skip_folders and item.object_dict.get('IsFolder'):
+        continue
+      self.announced.put(item.id, True)
+      await self.notify(item, ancestors)
+
+  async def notify(self, item, ancestors):
+    chans = set()
+    for item_id in self.watching.keys() & set(ancestors):
+      chans |= self.watching[item_id]
+    if not chans:
+      return
+
+    em = await emby_helper.makeEmbed(item, 'New item added: ')
+    for chan_id in chans:
+      chan = self.bot.get_channel(chan_id)
+      try:
+        await self.bot.send_message(chan, embed=em)
+      except:
+        pass
+
+  def index_watching(self):
+    self.watching = {}
+    for item_id, chans in self.conf['watching'].items():
+      if item_id != 'last' and chans:
+        self.watching[item_id] = set(chans)
 
   @commands.group(pass_context=True)
   async def emby(self, ctx):
@@ -48,9 +113,8 @@ class Emby:
   @emby.command(name='lookup', aliases=['info', 'i'], pass_context=True)
   async def _info(self, ctx, *, item_ids = ''):
     """print emby server info, or an embed for each item id"""
-    for item_id in item_ids.split():
-      item = await self.loop.run_in_executor(None, self.conn.info, item_id)
-      em   = await emby_helper.makeEmbed(item)
+    items = await emby_helper.fetch_items(item_ids.split())
+    for em in await emby_helper.makeEmbeds(items):
       await self.bot.send_message(ctx.message.channel, embed=em)
     if not item_ids:
       info = await self.loop.run_in_executor(None, self.conn.info)
@@ -73,6 +137,7 @@ class Emby:
         self.conf['watching'][item_id] = [ctx.message.channel.id]
     await self.bot.say(formatter.ok())
     self.conf.save()
+    self.index_watching()
 
   @emby.command(name='unwatch', aliases=['uwatch', 'uw'], pass_context=True)
   async def _uwatch(self, ctx, *, item_ids = ''):
@@ -88,6 +153,7 @@ class Emby:
         self.conf['watching'].get(item_id).remove(ctx.message.channel.id)
     await self.bot.say(formatter.ok())
     self.conf.save()
+    self.index_watching()
 
   @emby.command(name='search', aliases=['find', 's'], pass_context=True)
   async def _search(self, ctx, *, query : str):
@@ -113,16 +179,28 @@ class Emby:
       await self.bot.say('No results found')
       return
 
-    for result in results[:num]:
-      await self.loop.run_in_executor(None, result.update)
-      em = await emby_helper.makeEmbed(result)
+    items = await emby_helper.fetch_items(results[:num])
+    for em in await emby_helper.makeEmbeds(items):
       await self.bot.send_message(ctx.message.channel, embed=em)
 
   async def on_socket_message(self, message):
     if message['MessageType'] == 'LibraryChanged':
-      for eid in message['ItemsAdded']:
+      data = message.get('Data', message)
+      for eid in data.get('ItemsUpdated', []) + data.get('ItemsRemoved', []):
+        emby_helper.invalidate(eid)
+      added = data.get('ItemsAdded', [])
+      for eid in added:
         logging.info(eid+' has been added to emby')
-        print(eid+' has been added to emby')
+      if added:
+        await self.announce(added, skip_folders=True)
+        await self.mark_latest()
+
+  async def mark_latest(self):
+    # so polling after a restart or outage doesn't repeat these
+    latest = await self.loop.run_in_executor(None, self.conn.latest)
+    if latest:
+      self.conf['watching']['last'] = latest[0].id
+      self.conf.save()
 
 def setup(bot):
   bot.add_cog(Emby(bot))
@@ -77,7 +77,9 @@ class GroupMe:
   @commands.command(pass_context=True)
   async def add_groupme_link(self, ctx, g_id : str):
     channel = ctx.message.channel
-    group, g_bot = self.get_group_bot(g_id)
+    group, g_bot = await self.loop.run_in_executor(None, self.get_group_bot,
+                                                   g_id
+    )
 
     if not group:
       await self.bot.say(formatter.error("I am not in a group with that id"))
@@ -191,8 +193,9 @@ class GroupMe:
 
         try:
           #print('    p refresh')
-          self.g_groups[bot.group_id].refresh()
-          all_messages = self.g_groups[bot.group_id].messages()
+          group = self.g_groups[bot.group_id]
+          await self.loop.run_in_executor(None, group.refresh)
+          all_messages = await self.loop.run_in_executor(None, group.messages)
 
           #print('    p splice')
           for message in all_messages:
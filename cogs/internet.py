@@ -1,21 +1,42 @@
 #!/usr/bin/env python3
 
 import asyncio
-import json
+import logging
+import os
 from discord.ext import commands
 import discord
 from cogs.utils import format as formatter
-import aiohttp
 import html2text
 from urllib.parse import parse_qs
 from lxml import etree
 import re
 import asyncjisho
+from cogs.utils.cache import LRUCache
+from cogs.utils.config import Config
+from cogs.utils import jmdict
 
 class Search:
   def __init__(self, bot):
     self.bot   = bot
     self.jisho = asyncjisho.Jisho()
+    self.conf  = Config('configs/search.json')
+
+    # local dictionary built by cogs.utils.jmdict, jisho.org is the fallback
+    path = self.conf.get('jmdict', 'configs/jmdict.idx')
+    self.dictionary = None
+    if os.path.exists(path):
+      try:
+        self.dictionary = jmdict.Dictionary(path)
+      except ValueError as e:
+        logging.warning('jisho: {}'.format(e))
+
+    # normalized query -> entries, and -> task of a fetch in progress
+    self.results  = LRUCache('search', max_entries=256, ttl=3600)
+    self.searches = {}
+
+  def __unload(self):
+    if self.dictionary:
+      self.dictionary.close()
 
   @commands.command(name='search', aliases=['ddg', 'd', 'g'])
   async def google(self, *, query):
@@ -27,6 +48,9 @@ class Search:
     except RuntimeError as e:
       await self.bot.say(str(e))
     else:
+      if not entries:
+        await self.bot.say('no results found')
+        return
       next_two = entries[1:3]
       if next_two:
         formatted = '\n'.join(map(lambda x: '%s' % x, next_two))
@@ -38,9 +62,12 @@ class Search:
 
   @commands.command(pass_context=True, name='jisho', aliases=['j'])
   async def _jisho(self, context, *, search: str):
-    result = await self.jisho.lookup(search)
+    result = self.dictionary.lookup(search, limit=1) if self.dictionary else []
+    if not result:
+      result = await self.jisho.lookup(search)
     if len(result) == 0:
       await self.bot.say('no results found')
+      return
     else:
       result = result[0]
     #TODO use https once jisho finially implements it
@@ -58,6 +85,23 @@ class Search:
     await self.bot.say(embed=em)
 
   async def get_search_entries(self, query):
+    key     = ' '.join(query.lower().split())
+    entries = self.results.get(key)
+    if entries is not None:
+      return entries
+
+    # identical queries already being fetched share that fetch
+    task = self.searches.get(key)
+    if task is None:
+      task = self.bot.loop.create_task(self.fetch_search_entries(query))
+      task.add_done_callback(lambda t: self.searches.pop(key, None))
+      self.searches[key] = task
+    entries = await asyncio.shield(task)
+    if entries: # an empty page may be google throttling us, ask again later
+      self.results.put(key, entries)
+    return entries
+
+  async def fetch_search_entries(self, query):
     url_d = 'http://api.duckduckgo.com/'
     url_g = 'https://www.google.com/search'
     params_d = {
@@ -76,63 +120,73 @@ class Search:
     # list of entries
     entries = []
 
-    async with aiohttp.ClientSession() as session:
-      async with session.get(url_d, params=params_d, headers=headers) as resp:
-        if resp.status != 200:
-          raise RuntimeError('DuckDuckGo somehow failed to respond.')
-        results = json.loads(await resp.text())
-        if results['Answer']:
-          entries.append(results['Answer'].strip()+'\n')
-
-      async with session.get(url_g, params=params_g, headers=headers) as resp:
-        if resp.status != 200:
-          raise RuntimeError('Google somehow failed to respond.')
-
-        root = etree.fromstring(await resp.text(), etree.HTMLParser())
-
-        """
-        Tree looks like this.. sort of..
-        <div class="g">
-            ...
-            <h3>
-                <a href="/url?q=<url>" ...>title</a>
-            </h3>
-            ...
-            <span class="st">
-                <span class="f">date here</span>
-                summary here, can contain <em>tag</em>
-            </span>
-        </div>
-        """
-
-        search_nodes = root.findall(".//div[@class='g']")
-        for node in search_nodes:
-          entry_node = node.find(".//span[@class='st']")
-          if entry_node is None or not entry_node.text:
-            continue
-
-          url_node = node.find('.//h3/a')
-          if url_node is None:
-            continue
-
-          url = url_node.attrib['href']
-          if not url.startswith('/url?'):
-            continue
-
-          summary = html2text.html2text(etree.tostring(entry_node).decode('utf-8'))
-          url     = parse_qs(url[5:])['q'][0]
-
-          rep = {
-             '&amp;'    : '&',
-             '[\\s\n]+' : ' '
-          }
-
-          for r in rep:
-            summary = re.sub(r, rep[r], summary)
-
-          # if I ever cared about the description, this is how
-          entries.append('<{}>\n{}\n'.format(url, summary))
+    resp_d, resp_g = await asyncio.gather(
+      self.bot.web.get(url_d, params=params_d, headers=headers),
+      self.bot.web.get(url_g, params=params_g, headers=headers)
+    )
+
+    if resp_d.status != 200:
+      raise RuntimeError('DuckDuckGo somehow failed to respond.')
+    results = resp_d.json()
+    if results['Answer']:
+      entries.append(results['Answer'].strip()+'\n')
+
+    if resp_g.status != 200:
+      raise RuntimeError('Google somehow failed to respond.')
+
+    # lxml and html2text are slow on big pages, keep them off the loop
+    entries += await self.bot.loop.run_in_executor(None, parse_google,
+                                                   resp_g.text()
+    )
     return entries
 
+def parse_google(html):
+  entries = []
+  root = etree.fromstring(html, etree.HTMLParser())
+
+  """
+  Tree looks like this.. sort of..
+  <div class="g">
+      ...
+      <h3>
+          <a href="/url?q=<url>" ...>title</a>
+      </h3>
+      ...
+      <span class="st">
+          <span class="f">date here</span>
+          summary here, can contain <em>tag</em>
+      </span>
+  </div>
+  """
+
+  search_nodes = root.findall(".//div[@class='g']")
+  for node in search_nodes:
+    entry_node = node.find(".//span[@class='st']")
+    if entry_node is None or not entry_node.text:
+      continue
+
+    url_node = node.find('.//h3/a')
+    if url_node is None:
+      continue
+
+    url = url_node.attrib['href']
+    if not url.startswith('/url?'):
+      continue
+
+    summary = html2text.html2text(etree.tostring(entry_node).decode('utf-8'))
+    url     = parse_qs(url[5:])['q'][0]
+
+    rep = {
+       '&amp;'    : '&',
+       '[\\s\n]+' : ' '
+    }
+
+    for r in rep:
+      summary = re.sub(r, rep[r], summary)
+
+    # if I ever cared about the description, this is how
+    entries.append('<{}>\n{}\n'.format(url, summary))
+  return entries
+
 def setup(bot):
   bot.add_cog(Search(bot))
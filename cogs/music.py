@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 
+import os
+import json
+import time
+import threading
 import asyncio
 import discord
+import logging
 import random
 import re
 from discord.ext import commands
 from ctypes.util import find_library
 import cogs.utils.emby_helper as emby_helper
+import cogs.utils.opus_stream as opus_stream
+from cogs.utils.music_library import Library
+from cogs.utils.track_cache import TrackCache
+from cogs.utils.music_queue import MusicQueue, QueueEntry
+from cogs.utils import perms
 from cogs.utils.format import *
 
 if not discord.opus.is_loaded():
@@ -16,31 +26,91 @@ if not discord.opus.is_loaded():
     discord.opus.load_opus(find_library('opus'))
 
 class VoiceEntry:
-  def __init__(self, message, player=None, item=None):
-    self.requester = message.author
-    self.channel   = message.channel
-    self.player    = player
-    self.item      = item
+  def __init__(self, queued, channel, item=None, player=None):
+    self.queued       = queued
+    self.requester_id = queued.requester_id
+    self.channel      = channel
+    self.player       = player
+    self.item         = item
+    self.embed        = None # 'Now playing' embed, built with the player
 
   def __str__(self):
-    fmt = '*{0.title}* by {0.uploader} and requested by {1.display_name}'
+    fmt = '*{0.title}* by {0.uploader} and requested by <@{1}>'
     duration = self.player.duration
     if duration:
       fmt = fmt + ' [length: {0[0]}m {0[1]}s]'.format(divmod(duration, 60))
-    return fmt.format(self.player, self.requester)
+    return fmt.format(self.player, self.requester_id)
 
 
+class Prefetched:
+  """a player's stream with its first bytes already read"""
+  def __init__(self, head, stream):
+    self.head   = head
+    self.offset = 0
+    self.stream = stream
+
+  def read(self, size):
+    if self.offset >= len(self.head):
+      return self.stream.read(size)
+    data         = self.head[self.offset:self.offset+size]
+    self.offset += len(data)
+    if len(data) < size:
+      data += self.stream.read(size - len(data))
+    return data
+
 class VoiceState:
-  def __init__(self, bot, cog):
+  prefetch = 3840 * 50 # bytes of pcm read before a song starts, one second
+  attempts = 3
+
+  def __init__(self, bot, cog, server_id):
     self.current = None
-    self.vchan = None
+    self._vchan = None
     self.bot = bot
     self.cog = cog
+    self.server_id = server_id
     self.play_next_song = asyncio.Event()
-    self.songs = asyncio.Queue()
+    self.want_next = asyncio.Event()
+    self.ready = asyncio.Event() # set while connected to voice
     self.skip_votes = set() # a set of user_ids that voted
+    self.next = None # task preparing the song after the current one
+    self.active = time.time() # last seen playing to somebody
+
+    saved = cog.queues.get(server_id, {})
+    self.channel_id = saved.get('channel')
+    self.taken = [] # entries out of the queue, playing or about to
+    self.songs = MusicQueue([QueueEntry(*i) for i in saved.get('entries', [])],
+                            self.save
+    )
     self.audio_player = self.bot.loop.create_task(self.audio_player_task())
 
+  @property
+  def vchan(self):
+    return self._vchan
+
+  @vchan.setter
+  def vchan(self, vchan):
+    self._vchan = vchan
+    if vchan:
+      self.ready.set()
+    else:
+      self.ready.clear()
+
+  def save(self, queue=None):
+    self.cog.save_queue(self)
+
+  def players(self):
+    """the current player and the prepared next one, if any"""
+    players = [self.current.player] if self.current else []
+    if self.next and self.next.done() and not self.next.cancelled() and \
+       not self.next.exception():
+      players.append(self.next.result().player)
+    return [player for player in players if player]
+
+  def listeners(self):
+    if not self.vchan:
+      return []
+    return [m for m in self.vchan.channel.voice_members if not m.bot]
+
   def is_playing(self):
     if self.vchan is None or self.current is None or self.player is None:
       return False
@@ -59,86 +129,334 @@ class VoiceState:
   def toggle_next(self):
     self.bot.loop.call_soon_threadsafe(self.play_next_song.set)
 
+  def audio_codec(self, item):
+    for stream in item.object_dict.get('MediaStreams') or []:
+      if stream.get('Type') == 'Audio':
+        return (stream.get('Codec') or '').lower()
+    return ''
+
+  def bitrate(self):
+    """the voice channel's bitrate in kbps, capped by max_bitrate"""
+    bitrate = getattr(self.vchan.channel, 'bitrate', None) or 64000
+    return min(bitrate // 1000, self.cog.conf.get('max_bitrate', 128))
+
+  def set_bitrate(self):
+    encoder = getattr(self.vchan, 'encoder', None)
+    if hasattr(encoder, 'set_bitrate'):
+      encoder.set_bitrate(self.bitrate())
+
   async def emby_player(self, item):
-    url    = item.stream_url
-    player = self.vchan.create_ffmpeg_player(url,
-                                              before_options=' -threads 4 ',
-                                              options='-b:a 64k -bufsize 64k',
-                                              after=self.toggle_next
-    )
+    url     = item.stream_url
+    threads = ' -threads {} '.format(self.cog.conf.get('ffmpeg_threads', 1))
+    cache   = self.cog.track_cache
+    key     = TrackCache.key(item)
+    opus    = self.cog.conf.get('opus_passthrough', True) and \
+              self.audio_codec(item) == 'opus'
+    cached  = cache.open(key) if cache else None
+    if cached:
+      player = opus_stream.OpusPlayer(opus_stream.packets(cached), self.vchan,
+                                      self.toggle_next
+      )
+    elif opus or cache or self.cog.conf.get('shared_streams', False):
+      # already opus, ffmpeg only remuxes and nothing is decoded. otherwise
+      # it is encoded to opus once, for every server playing it
+      def spawn():
+        process = opus_stream.spawn(url, threads,
+                                    None if opus else self.bitrate()
+        )
+        self.cog.processes[process] = time.time()
+        if not cache:
+          return process, process.stdout, None
+        recorder = cache.recorder(key, process.stdout)
+        return process, recorder, recorder
+      sub    = self.cog.streams.subscribe(key, spawn)
+      player = opus_stream.OpusPlayer(sub, self.vchan, self.toggle_next,
+                                      sub.broadcast.process
+      )
+    else:
+      self.set_bitrate()
+      player = self.vchan.create_ffmpeg_player(url,
+                                               before_options=threads,
+                                               after=self.toggle_next
+      )
+      self.cog.processes[player.process] = time.time()
+      player.volume = 0.6
     player.duration   = int(float(item.object_dict['RunTimeTicks']) * (10**-7))
     player.title      = item.name
     try:
       player.uploader = ', '.join(item.artist_names)
     except:
       player.uploader = '-'
-    player.volume     = 0.6
 
     return player
 
-  async def audio_player_task(self):
-    while self.cog == self.bot.get_cog('Music'):
-      self.play_next_song.clear()
-      self.skip_votes.clear()
+  async def prepare(self, entry):
+    """
+    spawn the entry's ffmpeg and read its first second of audio
 
-      self.current = await self.songs.get()
+    a process that exits with an error before giving that much audio failed
+    to start, and is spawned again. the entry's player stays None if every
+    attempt failed
+    """
+    if entry.player or not entry.item:
+      return entry
+    for attempt in range(self.attempts):
+      player = await self.emby_player(entry.item)
+      try:
+        if hasattr(player, 'preload'):
+          ready = await self.bot.loop.run_in_executor(None, player.preload)
+        else:
+          ready = await self.bot.loop.run_in_executor(None, self.preload,
+                                                      player
+          )
+      except asyncio.CancelledError:
+        # leaving the subscription open would keep its broadcast alive
+        self.discard(player)
+        raise
+      if not ready:
+        self.discard(player)
+        continue
+      entry.player = player
+      return entry
+    return entry
+
+  def preload(self, player):
+    """read a pcm player's first second, False if its ffmpeg failed (blocking)"""
+    head = player.buff.read(self.prefetch)
+    if len(head) < self.prefetch and (player.process.wait() or not head):
+      return False
+    player.buff = Prefetched(head, player.buff)
+    return True
 
-      if self.current.item:
-        em = await emby_helper.makeEmbed(self.current.item, 'Now playing: ')
-        await self.bot.send_message(self.current.channel, embed=em)
-      else:
-        await self.bot.send_message(self.current.channel,
-          'Now playing: ' + str(self.current)
-        )
+  def discard(self, player):
+    """clean up after a player that will not be played"""
+    if hasattr(player, 'close'):
+      player.close()
+    elif player:
+      player.process.kill()
 
-      if not self.player:
-        self.current.player = await self.emby_player(self.current.item)
+  async def upcoming(self, wait):
+    """
+    the next entry, prepared wait seconds from now or once it is wanted
 
-      self.player.start()
+    it stays in the queue until then, so it can still be moved or removed
+    """
+    try:
+      await asyncio.wait_for(self.want_next.wait(), wait)
+    except asyncio.TimeoutError:
+      pass
+    await self.ready.wait()
+    queued = await self.songs.get()
+    self.taken.append(queued)
+    self.save()
+    try:
+      items = await emby_helper.fetch_items([queued.item_id])
+      entry = VoiceEntry(queued, self.bot.get_channel(self.channel_id),
+                         items[0] if items else None
+      )
+      if entry.item:
+        # the thumbnail may need uploading, done here rather than between songs
+        entry.embed = await emby_helper.makeEmbed(entry.item, 'Now playing: ')
+      return await self.prepare(entry)
+    except Exception:
+      self.untake(queued)
+      raise
 
-      if hasattr(self.player, 'process'):
-        await asyncio.sleep(3)
+  def done(self, entry):
+    """forget an entry that was taken from the queue"""
+    self.untake(entry.queued)
 
-        for i in range(10):
-          if self.play_next_song.is_set():
-            break
-          elif self.player.process.poll():
-            self.current.player = await self.emby_player(self.current.item)
-            self.player.start()
-          elif self.player.process.poll() is None:
-            await asyncio.sleep(1)
-          else:
-            break
+  def untake(self, queued):
+    if queued in self.taken:
+      self.taken.remove(queued)
+      self.save()
 
-      await self.play_next_song.wait()
+  async def audio_player_task(self):
+    try:
+      while self.cog == self.bot.get_cog('Music'):
+        self.play_next_song.clear()
+        self.skip_votes.clear()
+
+        if self.next is None:
+          self.next = self.bot.loop.create_task(self.upcoming(0))
+        self.want_next.set()
+        try:
+          self.current = await self.next
+        except Exception as e:
+          logging.info('music prepare: {}: {}'.format(type(e).__name__, e))
+          continue
+        finally:
+          self.want_next.clear()
+          self.next = None
+
+        if not self.player:
+          self.done(self.current)
+          name = self.current.item.name if self.current.item else \
+                 self.current.queued.item_id
+          await self.bot.send_message(self.current.channel,
+            'Could not play: ' + name
+          )
+          continue
+
+        self.player.start()
+        await self.bot.send_message(self.current.channel,
+                                    embed=self.current.embed
+        )
+
+        # get the next song ready shortly before this one ends
+        lead      = self.cog.conf.get('prefetch_lead', 15)
+        wait      = max(getattr(self.player, 'duration', 0) - lead, 0)
+        self.next = self.bot.loop.create_task(self.upcoming(wait))
+
+        await self.play_next_song.wait()
+        self.done(self.current)
+    finally:
+      # a song prepared but never played still has an ffmpeg running
+      if self.next and not self.next.cancel() and not self.next.cancelled() \
+                  and not self.next.exception():
+        self.discard(self.next.result().player)
 
 class Music:
   def __init__(self, bot):
     self.bot = bot
     self.voice_states = {}
     self.conn = emby_helper.conn
+    self.conf = emby_helper.conf
+    budget    = self.conf.get('track_cache_mb', 0)
+    self.track_cache = TrackCache('configs/track_cache', budget * 2**20) \
+                       if budget else None
+    self.library = Library('configs/music_library.json', self.conn,
+                           self.conf.get('library_full_sync', 86400)
+    )
+    self.streams = opus_stream.Multiplexer(
+                     self.conf.get('stream_buffer', 600) * 50 # 20ms packets
+    )
+    self.queues = load_json(queues_file) # server id -> saved queue
+    self.unsaved = set() # states whose queue changed since the last write
+    self.queue_flush = None
+    self.queue_lock = threading.Lock()
+    self.queue_version = 0
+    self.queue_written = 0
+    self.processes = {} # every ffmpeg spawned -> when
+    self.synced = asyncio.Event()
+    if len(self.library):
+      self.synced.set()
+    self.bot.loop.create_task(self.sync_library())
+    self.bot.loop.create_task(self.reap())
+
+  async def sync_library(self):
+    while self == self.bot.get_cog('Music'):
+      try:
+        await self.bot.loop.run_in_executor(None, self.library.sync)
+      except Exception as e:
+        logging.info('music library sync: {}: {}'.format(type(e).__name__, e))
+      self.synced.set()
+      await asyncio.sleep(self.conf.get('library_sync', 600))
 
   def get_voice_state(self, server):
     state = self.voice_states.get(server.id)
     if state is None:
-      state = VoiceState(self.bot, self)
+      state = VoiceState(self.bot, self, server.id)
       self.voice_states[server.id] = state
 
     return state
 
+  def save_queue(self, state):
+    """
+    keep a server's queue (songs playing first) for restarts and reloads
+
+    changes within queue_save_delay seconds are written together, from
+    the executor
+    """
+    self.unsaved.add(state)
+    if self.queue_flush is None:
+      self.queue_flush = self.bot.loop.call_later(
+                           self.conf.get('queue_save_delay', 2),
+                           self.flush_queues
+      )
+
+  def flush_queues(self, wait=False):
+    if self.queue_flush:
+      self.queue_flush.cancel()
+    self.queue_flush = None
+    for state in self.unsaved:
+      entries = [i.to_list() for i in state.taken + list(state.songs)]
+      if entries:
+        self.queues[state.server_id] = {
+          'channel' : state.channel_id,
+          'entries' : entries
+        }
+      else:
+        self.queues.pop(state.server_id, None)
+    self.unsaved.clear()
+    # saved queues are replaced, never changed, so a shallow copy is enough
+    self.queue_version += 1
+    args = (dict(self.queues), self.queue_version)
+    if wait:
+      self.write_queues(*args)
+    else:
+      self.bot.loop.run_in_executor(None, self.write_queues, *args)
+
+  def write_queues(self, queues, version):
+    with self.queue_lock:
+      if version <= self.queue_written: # a newer copy is already on disk
+        return
+      tmp = queues_file + '.tmp'
+      with open(tmp, 'w') as f:
+        json.dump(queues, f)
+      os.replace(tmp, queues_file)
+      self.queue_written = version
+
   async def create_voice_client(self, channel):
     voice = await self.bot.join_voice_channel(channel)
     state = self.get_voice_state(channel.server)
     state.vchan = voice
 
-  def __unload(self):
+  async def reap(self):
+    """
+    close voice sessions nobody listened to for voice_idle seconds, and
+    kill ffmpegs that no player or broadcast uses any more
+    """
+    while self == self.bot.get_cog('Music'):
+      await asyncio.sleep(30)
+      now  = time.time()
+      idle = self.conf.get('voice_idle', 300)
+      for server_id, state in list(self.voice_states.items()):
+        if state.is_playing() and state.listeners():
+          state.active = now
+        elif now - state.active > idle:
+          await self.close_state(server_id)
+      self.reap_processes(now)
+
+  def reap_processes(self, now):
+    live = {b.process for b in list(self.streams.broadcasts.values())}
     for state in self.voice_states.values():
+      live.update(getattr(p, 'process', None) for p in state.players())
+    for process, spawned in list(self.processes.items()):
+      if process.poll() is not None: # also reaps it if it was a zombie
+        del self.processes[process]
+      elif process not in live and now - spawned > 60:
+        process.kill()
+
+  async def close_state(self, server_id):
+    """stop a server's playback and leave its voice channel, the queue stays"""
+    state = self.voice_states.pop(server_id, None)
+    if state is None:
+      return
+    if state.is_playing():
+      state.player.stop()
+    state.audio_player.cancel()
+    if state.vchan:
       try:
-        state.audio_player.cancel()
-        if state.vchan:
-          self.bot.loop.create_task(state.vchan.disconnect())
+        await state.vchan.disconnect()
       except:
         pass
+      state.vchan = None
+
+  def __unload(self):
+    for server_id in list(self.voice_states):
+      self.bot.loop.create_task(self.close_state(server_id))
+    self.flush_queues(wait=True)
 
   @commands.command(pass_context=True, no_pm=True)
   async def join(self, ctx, *, channel : discord.Channel):
@@ -183,13 +501,17 @@ class Music:
 
       search terms:
         - search terms are space seperated and case insensitive
+        - songs must contain every term, and none of the -terms
         - if a term is an itemid, that item will be included
-        - will search playlists, songs, albums, and album artists FOR:
+        - if a term is a playlist, album or artist id, its songs are included
+        - will search songs FOR:
           - name/title
           - filepath
-          - description
-          - artist/album artist names (for songs)
+          - artist/album artist names
+          - album and playlist names
         NOTE: if none are specified - all songs on emby will be considered
+      songs are ranked by where the terms were found (title first, then
+      artist, album, playlist and filepath), -a plays them in that order
 
     If there is a song currently in the queue, then it is
     queued until the next song is done playing.
@@ -230,43 +552,47 @@ class Music:
         return
 
     try:
-      plsts=await self.bot.loop.run_in_executor(None,lambda:self.conn.playlists)
-      songs=await self.bot.loop.run_in_executor(None,lambda:self.conn.songs)
-      albms=await self.bot.loop.run_in_executor(None,lambda:self.conn.albums)
-      artts=await self.bot.loop.run_in_executor(None,lambda:self.conn.artists)
-
-
-      items = await self.bot.loop.run_in_executor(None, search_f, set(search),
-                                                  *plsts, *songs, *albms, *artts
+      # the library mirror is only empty before its first sync
+      await self.synced.wait()
+      ranked = await self.bot.loop.run_in_executor(None, self.library.search,
+                                                   search
       )
 
-      if hasattr(items[0], 'songs') and items[0].songs:
-        items = items[0].songs
-
-      items = [s for s in items if s.type == 'Audio']
-
-      if not items:
+      if not ranked:
         await self.bot.say('could not find song')
         return
 
+      items = [track for score, track in ranked]
       if shuf:
         random.shuffle(items)
 
+      if not mult:
+        # best match, picking at random between equally good ones
+        best  = [track for score, track in ranked if score == ranked[0][0]]
+        items = [random.choice(items if shuf else best)]
+      elif num > 0:
+        items = items[:num]
+
+      state.channel_id = ctx.message.channel.id
+      state.songs.put([QueueEntry(i['id'], ctx.message.author.id)
+                       for i in items]
+      )
+
       if mult:
-        if num > 0:
-          items = items[:num]
         em = await emby_helper.makeEmbed(self.conn, 'Queued: ')
         songs_str = ''
         for i in items:
-          if hasattr(i, 'index_number'):
-            songs_str += '{:02} - {}\n'.format(i.index_number, i.name)
+          if i['index']:
+            songs_str += '{:02} - {}\n'.format(i['index'], i['name'])
           else:
-            songs_str += '{}\n'.format(i.name)
-          await self._play_emby(ctx, state, i, display=False)
-        em.add_field(name='Items', value=songs_str)
+            songs_str += '{}\n'.format(i['name'])
+        em.add_field(name='Items', value=songs_str[:1024])
         await self.bot.say(embed=em)
       else:
-        await self._play_emby(ctx, state, random.choice(items))
+        item = await emby_helper.fetch_items([items[0]['id']])
+        if item:
+          em = await emby_helper.makeEmbed(item[0], 'Queued: ')
+          await self.bot.say(embed=em)
 
     except Exception as e:
       fmt='An error occurred while processing this request: ```py\n{}: {}\n```'
@@ -275,12 +601,97 @@ class Music:
       )
       raise
 
-  async def _play_emby(self, ctx, state, item, display=True):
-    entry = VoiceEntry(ctx.message, item=item)
-    if display:
-      em = await emby_helper.makeEmbed(item, 'Queued: ')
-      await self.bot.say(embed=em)
-    await state.songs.put(entry)
+  @commands.group(pass_context=True, no_pm=True)
+  async def queue(self, ctx):
+    """
+    manages the server's music queue
+    Note: if no sub-command is specified, the queue will be listed
+    """
+    if ctx.invoked_subcommand is None:
+      await self._queue_list(ctx)
+
+  @queue.command(name='list', aliases=['l', 'ls'], pass_context=True)
+  async def _queue_list_wp(self, ctx, page : int = 1):
+    """
+    lists the songs queued, ten per page
+    """
+    await self._queue_list(ctx, page)
+
+  @queue.command(name='remove', aliases=['rem', 'rm', 'r'], pass_context=True)
+  async def _queue_remove(self, ctx, index : int):
+    """
+    removes a song from the queue
+    Note: indicies start at 1
+    """
+    songs = self.get_voice_state(ctx.message.server).songs
+    if len(songs) < index or index <= 0:
+      await self.bot.say(error('Invalid index'))
+    else:
+      entry = songs.pop(index - 1)
+      await self.bot.say(ok('Removed {}'.format(
+                                      self.song_name(entry.item_id)
+      )))
+
+  @queue.command(name='move', aliases=['mv', 'm'], pass_context=True)
+  async def _queue_move(self, ctx, index : int, to : int):
+    """
+    moves a song to another place in the queue
+    Note: indicies start at 1
+    """
+    songs = self.get_voice_state(ctx.message.server).songs
+    if not (0 < index <= len(songs) and 0 < to <= len(songs)):
+      await self.bot.say(error('Invalid index'))
+    else:
+      songs.move(index - 1, to - 1)
+      await self.bot.say(ok())
+
+  @queue.command(name='shuffle', aliases=['s'], pass_context=True)
+  async def _queue_shuffle(self, ctx):
+    """
+    shuffles the queued songs
+    """
+    self.get_voice_state(ctx.message.server).songs.shuffle()
+    await self.bot.say(ok())
+
+  @queue.command(name='dedupe', aliases=['d'], pass_context=True)
+  async def _queue_dedupe(self, ctx):
+    """
+    removes songs that are already queued earlier
+    """
+    removed = self.get_voice_state(ctx.message.server).songs.dedupe()
+    await self.bot.say(ok('Removed {} songs'.format(removed)))
+
+  @queue.command(name='clear', aliases=['c'], pass_context=True)
+  async def _queue_clear(self, ctx):
+    """
+    removes every queued song
+    """
+    self.get_voice_state(ctx.message.server).songs.clear()
+    await self.bot.say(ok())
+
+  async def _queue_list(self, ctx, page=1):
+    server = ctx.message.server
+    songs  = self.get_voice_state(server).songs
+    if not songs:
+      await self.bot.say('The queue is empty.')
+      return
+
+    pages  = (len(songs) + 9) // 10
+    page   = min(max(page, 1), pages)
+    start  = (page - 1) * 10
+    length = len(str(len(songs)))
+    line   = '{{:0{}}} - {{}} ({{}})\n'.format(length)
+    msg    = 'Queue, page {}/{}:\n'.format(page, pages)
+    for i, entry in enumerate(songs.slice(start, start + 10), start + 1):
+      member = server.get_member(entry.requester_id)
+      msg   += line.format(i, self.song_name(entry.item_id),
+                           member.display_name if member else '-'
+      )
+    await self.bot.say(msg)
+
+  def song_name(self, item_id):
+    track = self.library.tracks.get(item_id)
+    return track['name'] if track else item_id
 
   @commands.command(pass_context=True, no_pm=True)
   async def volume(self, ctx, value : int):
@@ -289,6 +700,9 @@ class Music:
     state = self.get_voice_state(ctx.message.server)
     if state.is_playing():
       player = state.player
+      if isinstance(player, opus_stream.OpusPlayer):
+        await self.bot.say('This song is not re-encoded, so its volume is fixed')
+        return
       player.volume = value / 100
       await self.bot.say('Set the volume to {:.0%}'.format(player.volume))
 
@@ -321,12 +735,33 @@ class Music:
       player = state.player
       player.stop()
 
-    try:
-      state.audio_player.cancel()
-      del self.voice_states[server.id]
-      await state.vchan.disconnect()
-    except:
-      pass
+    state.taken.clear()
+    state.songs.clear()
+    await self.close_state(server.id)
+
+  @commands.command(hidden=True)
+  @perms.is_owner()
+  async def sessions(self):
+    """Shows voice sessions, their ffmpegs' cpu time and memory."""
+    now    = time.time()
+    shared = len(self.streams.broadcasts)
+    out    = '{} sessions, {} shared streams, {} ffmpegs\n'.format(
+               len(self.voice_states), shared, len(self.processes)
+    )
+    fmt    = '{:<20} {:>5} {:>6} {:>5} {:>7} {:>8}\n'
+    out   += fmt.format('server', 'queue', 'idle', 'pid', 'cpu s', 'rss kB')
+    for server_id, state in self.voice_states.items():
+      server  = self.bot.get_server(server_id)
+      process = next((p.process for p in state.players()
+                      if getattr(p, 'process', None)), None)
+      usage   = process_usage(process.pid) if process else None
+      out    += fmt.format((server.name if server else server_id)[:20],
+                           len(state.songs), int(now - state.active),
+                           process.pid if process else '-',
+                           '{:.1f}'.format(usage[0]) if usage else '-',
+                           usage[1] // 1024 if usage else '-'
+      )
+    await self.bot.say(code(out[:-1]))
 
   @commands.command(pass_context=True, no_pm=True)
   async def skip(self, ctx):
@@ -341,7 +776,7 @@ class Music:
       return
 
     voter = ctx.message.author
-    if voter == state.current.requester:
+    if voter.id == state.current.requester_id:
       await self.bot.say('Requester requested skipping song...')
       state.skip()
     elif voter.id not in state.skip_votes:
@@ -375,38 +810,27 @@ class Music:
                                                                  skip_count)
         )
 
-def search_f(terms, *items):
-  out = []
-  for item in items:
-    strings = [item.id, item.name]
-    for attr in ('artist_names', 'overview', 'path'):
-      if hasattr(item, attr):
-        attribute = getattr(item, attr, '')
-        if type(attribute) == list:
-          attribute = ', '.join(attribute)
-        strings.append(attribute)
-    if match(terms, *strings):
-      out.append(item)
-  return out
-
-def match(pattern, *strings):
-  for patt in pattern:
-    lowered = patt.lower()
-    if strings[0].lower() == patt: # ID matched
-      return True
-    nonNegative = False
-    for string in strings[1:]:
-      if lowered[0] == '-':
-        if lowered[1:] in string.lower():
-          return False
-      elif lowered in string.lower():
-        break
-      else:
-        nonNegative = True
-    else:
-      if nonNegative:
-        return False
-  return True
+queues_file = 'configs/music_queue.json'
+
+def load_json(filename):
+  try:
+    with open(filename, 'r') as f:
+      return json.load(f)
+  except:
+    return {}
+
+def process_usage(pid):
+  '''(cpu seconds, resident bytes) of a process, from /proc'''
+  try:
+    with open('/proc/{}/stat'.format(pid)) as f:
+      stat = f.read().rsplit(')', 1)[1].split()
+    with open('/proc/{}/statm'.format(pid)) as f:
+      pages = int(f.read().split()[1])
+  except (OSError, IndexError, ValueError):
+    return None
+  ticks = os.sysconf('SC_CLK_TCK')
+  return ((int(stat[11]) + int(stat[12])) / ticks,
+          pages * os.sysconf('SC_PAGE_SIZE'))
 
 def setup(bot):
   bot.add_cog(Music(bot))
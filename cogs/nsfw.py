@@ -37,6 +37,9 @@ class NSFW:
     self.lolibooru = pybooru.Moebooru('lolibooru',**self.conf['lolibooru-conf'])
     self.safebooru = pybooru.Danbooru('safebooru',**self.conf['safebooru-conf'])
 
+    for booru in (self.yandere, self.danbooru, self.lolibooru, self.safebooru):
+      self.bot.web.mount(booru.client)
+
   @commands.group(pass_context=True)
   async def nsfw(self, ctx):
     """NSFW stuff"""
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+# name -> cache, so the admin cog can report on every cache the bot holds
+caches = {}
+
+class LRUCache:
+  '''
+  least recently used cache with optional entry/byte caps and a ttl
+
+  ttl is counted from when a key was stored, not from when it was last read.
+  sizeof(value) gives the bytes a value counts against max_bytes
+  '''
+  def __init__(self, name=None, max_entries=None, max_bytes=None, ttl=None,
+               sizeof=None):
+    self.name        = name
+    self.max_entries = max_entries
+    self.max_bytes   = max_bytes
+    self.ttl         = ttl
+    self.sizeof      = sizeof or (lambda value: 0)
+    self.lock        = threading.RLock()
+    self.data        = OrderedDict() # key -> [value, created, accessed, size]
+    self.bytes       = 0
+    self.hits        = 0
+    self.misses      = 0
+    self.evictions   = 0
+    self.expired     = 0
+    if name:
+      caches[name] = self
+
+  def __len__(self):
+    return len(self.data)
+
+  def __contains__(self, key):
+    return self.peek(key) is not None
+
+  def items(self):
+    with self.lock:
+      return [(key, entry[0]) for key, entry in self.data.items()]
+
+  def get(self, key, default=None):
+    with self.lock:
+      entry = self.lookup(key)
+      if entry is None:
+        self.misses += 1
+        return default
+      self.hits    += 1
+      entry[2]      = time.time()
+      self.data.move_to_end(key)
+      return entry[0]
+
+  def peek(self, key, default=None):
+    '''like get, but without counting or touching the entry'''
+    with self.lock:
+      entry = self.lookup(key)
+      return default if entry is None else entry[0]
+
+  def put(self, key, value, created=None, accessed=None):
+    with self.lock:
+      now  = time.time()
+      size = self.sizeof(value)
+      old  = self.data.pop(key, None)
+      if old is not None:
+        self.bytes -= old[3]
+        created     = created or old[1]
+      self.data[key] = [value, created or now, accessed or now, size]
+      self.bytes    += size
+      self.evict()
+
+  def pop(self, key, default=None):
+    with self.lock:
+      entry = self.data.pop(key, None)
+      if entry is None:
+        return default
+      self.bytes -= entry[3]
+      return entry[0]
+
+  def clear(self):
+    with self.lock:
+      self.data.clear()
+      self.bytes = 0
+
+  def lookup(self, key):
+    entry = self.data.get(key)
+    if entry is not None and self.ttl and time.time() - entry[1] > self.ttl:
+      self.pop(key)
+      self.expired += 1
+      return None
+    return entry
+
+  def evict(self):
+    while self.data and (
+          (self.max_entries and len(self.data) > self.max_entries) or
+          (self.max_bytes   and self.bytes     > self.max_bytes)):
+      key, entry  = self.data.popitem(last=False)
+      self.bytes -= entry[3]
+      self.evictions += 1
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        'entries'     : len(self.data),
+        'max_entries' : self.max_entries,
+        'bytes'       : self.bytes,
+        'max_bytes'   : self.max_bytes,
+        'hits'        : self.hits,
+        'misses'      : self.misses,
+        'hit_rate'    : self.hits / lookups if lookups else 0.0,
+        'evictions'   : self.evictions,
+        'expired'     : self.expired
+      }
+
+class PersistentLRUCache(LRUCache):
+  '''
+  LRUCache kept in a json file, entries are written in lru order
+
+  with a save_delay (seconds) changes are gathered and written together
+  by a timer thread that long after the first of them, instead of the
+  whole file being rewritten by whoever made each change
+  '''
+  def __init__(self, filename, *args, save_delay=None, **kw):
+    super(PersistentLRUCache, self).__init__(*args, **kw)
+    self.filename   = filename
+    self.save_delay = save_delay
+    self.timer      = None
+    self.save_lock  = threading.Lock()
+    self.version    = 0 # of the last snapshot taken
+    self.written    = 0 # of the snapshot in the file
+    self.load()
+
+  def load(self):
+    try:
+      with open(self.filename, 'r') as f:
+        entries = json.load(f)
+    except:
+      entries = []
+    with self.lock:
+      for key, value, created, accessed in entries:
+        LRUCache.put(self, key, value, created, accessed)
+
+  def save(self):
+    with self.lock:
+      if self.timer:
+        self.timer.cancel()
+        self.timer = None
+      entries       = [[key, e[0], e[1], e[2]] for key, e in self.data.items()]
+      self.version += 1
+      version       = self.version
+    # written outside of the cache's lock, so lookups never wait on the disk
+    with self.save_lock:
+      if version <= self.written:
+        return # a newer snapshot got there first
+      tmp = self.filename + '.tmp'
+      with open(tmp, 'w') as f:
+        json.dump(entries, f)
+      os.replace(tmp, self.filename)
+      self.written = version
+
+  def changed(self):
+    if not self.save_delay:
+      self.save()
+      return
+    with self.lock:
+      if self.timer is None:
+        # not a daemon, so changes still pending at exit are written
+        self.timer = threading.Timer(self.save_delay, self.save)
+        self.timer.start()
+
+  def put(self, *args, **kw):
+    super(PersistentLRUCache, self).put(*args, **kw)
+    self.changed()
+
+  def pop(self, key, default=None):
+    value = super(PersistentLRUCache, self).pop(key, default)
+    self.changed()
+    return value
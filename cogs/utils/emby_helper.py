@@ -5,6 +5,7 @@ from discord import Embed
 import hashlib
 import asyncio
 from cogs.utils.config import Config
+from cogs.utils.cache import LRUCache
 from embypy import Emby as EmbyPy
 
 colours = [0x1f8b4c, 0xc27c0e, 0x3498db, 0x206694, 0x9b59b6,
@@ -28,7 +29,82 @@ if 'auth' not in conf or not conf['auth']:
 
 conn = EmbyPy(conf['address'], **conf['auth'], ws=False)
 
+# item id -> ((primary image tag, etag), embed dict), built embeds are reused
+# until the item changes, makeEmbed hands out copies so callers can edit them
+embeds    = LRUCache('embeds', max_entries=conf.get('embed_cache', 512))
+from_dict = getattr(Embed, 'from_dict', None) or Embed.from_data
+
+# item id -> ids of its parent, grandparent... up to the library root
+parents = LRUCache('emby parents', max_entries=4096,
+                   ttl=conf.get('parent_ttl', 3600)
+)
+
+item_fields = 'Overview,Genres,Path,ParentId,Etag,DateCreated,DateModified,' \
+              'MediaStreams'
+
+def get_items(items):
+  '''
+  full items for many ids (or partial items) with one request (blocking)
+
+  results keep the order they were asked for in, unknown ids are dropped
+  '''
+  ids = [getattr(i, 'id', i) for i in items]
+  if not ids:
+    return []
+  data  = conn.connector.getJson('/Users/{UserId}/Items', remote=False,
+                                 Ids=','.join(ids), Fields=item_fields
+  )
+  found = {item.id : item for item in conn.process(data.get('Items', []))}
+  return [found[i] for i in ids if i in found]
+
+async def fetch_items(items):
+  loop = asyncio.get_event_loop()
+  return await loop.run_in_executor(None, get_items, items)
+
+def hydrate(items):
+  '''get_items, paired with each item's ancestor ids (blocking)'''
+  return [(item, ancestor_ids(item)) for item in get_items(items)]
+
+def ancestor_ids(item):
+  if not item.parent_id:
+    return []
+  return [item.parent_id] + parent_chain(item.parent_id)
+
+def parent_chain(item_id):
+  # items of one season or series share all but the first step of the walk
+  chain = parents.get(item_id)
+  if chain is None:
+    chain = ancestor_ids(conn.info(item_id))
+    parents.put(item_id, chain)
+  return chain
+
 async def makeEmbed(item, message=''):
+  version = embed_version(item)
+  cached  = embeds.get(item.id)
+  if cached and cached[0] == version:
+    em = from_dict(cached[1])
+  else:
+    em = await buildEmbed(item)
+    embeds.put(item.id, (version, em.to_dict()))
+    em = from_dict(em.to_dict())
+  em.title = message + (em.title or '')
+  return em
+
+async def makeEmbeds(items, message=''):
+  return await asyncio.gather(*[makeEmbed(item, message) for item in items])
+
+def embed_version(item):
+  data = getattr(item, 'object_dict', {})
+  return (data.get('ImageTags', {}).get('Primary'),
+          data.get('Etag') or data.get('DateModified'))
+
+def invalidate(item_id=None):
+  if item_id:
+    embeds.pop(item_id)
+  else:
+    embeds.clear()
+
+async def buildEmbed(item):
   loop = asyncio.get_event_loop()
   if hasattr(item, 'index_number'):
     name = '{:02} - {}'.format(item.index_number, item.name)
@@ -38,7 +114,7 @@ async def makeEmbed(item, message=''):
   img_url          = item.primary_image_url
   if 'https' in img_url:
     img_url        = await loop.run_in_executor(None, puush.get_url, img_url)
-  em.title         = message+name
+  em.title         = name
   if hasattr(item, 'overview') and item.overview:
     if len(item.overview) > 250:
       des = item.overview[:247] + '...'
@@ -52,7 +128,7 @@ async def makeEmbed(item, message=''):
   em.set_thumbnail(url=img_url)
   if hasattr(item, 'artist_names'):
     if len(item.artist_names) == 1:
-      em.add_field(name='Artist: ', item.artist_names[0])
+      em.add_field(name='Artist: ', value=item.artist_names[0])
     else:
       em.add_field(name='Artists: ', value=', '.join(item.artist_names))
   if hasattr(item, 'genres') and item.genres:
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import json
+import asyncio
+import aiohttp
+
+def websocket_url(address, auth):
+  '''emby's websocket endpoint for the http(s) address of the server'''
+  address = address.rstrip('/')
+  if address.startswith('http'):
+    address = 'ws' + address[4:]
+  return '{}/embywebsocket?api_key={}&deviceId={}'.format(
+          address, auth.get('api_key', ''), auth.get('device_id', '')
+  )
+
+async def follow(session, url, handler, on_connect=None, heartbeat=30):
+  '''
+  pass every message of one websocket connection to handler
+
+  returns once the connection is closed, or when a ping sent after
+  heartbeat quiet seconds goes unanswered for as long again. raises if it
+  could not be made. on_connect is awaited after connecting, before the
+  first message
+  '''
+  async with session.ws_connect(url, autoping=False) as ws:
+    if on_connect:
+      await on_connect()
+    pinged = False
+    while True:
+      try:
+        msg = await asyncio.wait_for(ws.receive(), heartbeat)
+      except asyncio.TimeoutError:
+        if pinged:
+          break
+        ws.ping()
+        pinged = True
+        continue
+      pinged = False
+      if msg.type == aiohttp.WSMsgType.TEXT:
+        await handler(json.loads(msg.data))
+      elif msg.type == aiohttp.WSMsgType.PING:
+        ws.pong(msg.data)
+      elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                        aiohttp.WSMsgType.ERROR):
+        break
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+'''
+small stand-in for an emby server, for trying the emby cog offline
+
+it answers item lookups (one at a time or in batches, at / and at /emby/
+like emby does) for whatever items were added, and pushes LibraryChanged
+messages to websocket clients. run it with:
+  python3 -m cogs.utils.fake_emby [port]
+tests/test_fake_emby.py runs the emby cog against it
+'''
+
+import sys
+import time
+import asyncio
+from aiohttp import web
+
+class FakeEmby:
+  def __init__(self, host='127.0.0.1', port=8096):
+    self.host    = host
+    self.port    = port
+    self.items   = {} # id -> item json, like emby returns it
+    self.order   = [] # ids, newest first
+    self.sockets = set()
+    self.server  = None
+
+  @property
+  def address(self):
+    return 'http://{}:{}'.format(self.host, self.port)
+
+  async def start(self):
+    loop = asyncio.get_event_loop()
+    app  = web.Application(loop=loop)
+    app.router.add_get('/embywebsocket', self.websocket)
+    for prefix in ('', '/emby'):
+      app.router.add_get(prefix + '/Users/{user}/Items',        self.batch)
+      app.router.add_get(prefix + '/Users/{user}/Items/Latest', self.latest)
+      app.router.add_get(prefix + '/Users/{user}/Items/{id}',   self.item)
+      app.router.add_get(prefix + '/Items/{id}',                self.item)
+    self.app     = app
+    self.handler = app.make_handler()
+    self.server  = await loop.create_server(self.handler, self.host,
+                                            self.port
+    )
+    self.port    = self.server.sockets[0].getsockname()[1] # if port was 0
+
+  async def stop(self):
+    for ws in list(self.sockets):
+      await ws.close()
+    if self.server:
+      self.server.close()
+      await self.server.wait_closed()
+      await self.app.shutdown()
+      await self.handler.finish_connections(5)
+      await self.app.cleanup()
+      self.server = None
+
+  def put(self, item_id, name, parent_id=None, item_type='Folder', **fields):
+    '''add or replace an item without telling anyone, returns its json'''
+    item = dict(fields, Id=item_id, Name=name, ParentId=parent_id,
+                Type=item_type,
+                DateCreated=time.strftime('%Y-%m-%dT%H:%M:%SZ')
+    )
+    item.setdefault('IsFolder', item_type in ('Folder', 'Series', 'Season',
+                                              'MusicAlbum', 'BoxSet'))
+    if item_id not in self.items:
+      self.order.insert(0, item_id)
+    self.items[item_id] = item
+    return item
+
+  async def add(self, item_id, name, parent_id=None, item_type='Episode',
+                **fields):
+    '''add an item and tell connected clients about it'''
+    self.put(item_id, name, parent_id, item_type, **fields)
+    await self.push(added=[item_id])
+
+  async def push(self, added=(), updated=(), removed=()):
+    message = {
+      'MessageType' : 'LibraryChanged',
+      'Data'        : {
+        'ItemsAdded'   : list(added),
+        'ItemsUpdated' : list(updated),
+        'ItemsRemoved' : list(removed)
+      }
+    }
+    for ws in list(self.sockets):
+      ws.send_json(message)
+
+  async def websocket(self, request):
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    self.sockets.add(ws)
+    try:
+      async for msg in ws:
+        pass
+    finally:
+      self.sockets.discard(ws)
+    return ws
+
+  async def latest(self, request):
+    return web.json_response([self.items[i] for i in self.order[:20]])
+
+  async def batch(self, request):
+    ids   = request.GET.get('Ids')
+    ids   = ids.split(',') if ids else self.order
+    items = [self.items[i] for i in ids if i in self.items]
+    parent_id = request.GET.get('ParentId')
+    if parent_id:
+      items = [item for item in items if item['ParentId'] == parent_id]
+    return web.json_response({'Items':items, 'TotalRecordCount':len(items)})
+
+  async def item(self, request):
+    item = self.items.get(request.match_info['id'])
+    if item is None:
+      raise web.HTTPNotFound()
+    return web.json_response(item)
+
+async def main(port):
+  server = FakeEmby(port=port)
+  await server.start()
+  print('fake emby on {}/embywebsocket'.format(server.address))
+  server.put('series', 'Fake series', item_type='Series')
+  print('watch "series" to be told about its new episodes')
+  count = 0
+  while True:
+    await asyncio.sleep(10)
+    count += 1
+    await server.add('fake{}'.format(count), 'Episode {}'.format(count),
+                     parent_id='series'
+    )
+
+if __name__ == '__main__':
+  port = int(sys.argv[1]) if len(sys.argv) > 1 else 8096
+  asyncio.get_event_loop().run_until_complete(main(port))
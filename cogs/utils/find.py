@@ -1,42 +1,184 @@
 #!/usr/bin/env python3
 
 import zipfile
-import tempfile
+import threading
 import random
+import re
 import os
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cogs.utils.path_index import PathIndex
+
+index_file = 'configs/find_index.json'
+indexes    = {}
+index_lock = threading.Lock()
+
+def get_index(directory):
+  with index_lock:
+    index = indexes.get(directory)
+    if index is None:
+      index = PathIndex(directory, index_file)
+      indexes[directory] = index
+    return index
+
+def refresh(directory):
+  index = get_index(directory)
+  if index.refresh():
+    index.save()
+  return len(index)
 
 def search(directory, pattern, single=True):
   pattern = set(filter(None, pattern))
-  matches = []
+  index   = get_index(directory)
 
-  for root, directories, filenames in os.walk(directory):
-    for filename in filenames:
-      filename = os.path.join(root,filename)
-      filename = os.path.realpath(filename)
-      if match(filename, pattern):
-        matches.append(filename)
+  if index.ready:
+    matches = index.query(pattern | {'-.git'})
+  else:
+    matches = scan(directory, Matcher(pattern))
 
   if single:
     return random.choice(matches)
   return matches
 
-def match(filename, pattern):
-  pattern.add('-.git')
-  for i in pattern:
-    if i[0] == '-':
-      if i[1:].lower() in filename.lower():
-        return False
-    elif i not in filename.lower():
+def scan(directory, matcher, workers=None):
+  '''
+  parallel walk of directory, returns the real paths accepted by matcher
+
+  each directory is listed by a pool thread and its subdirectories are
+  queued as soon as they are seen, excluded directories are never entered
+  '''
+  matches = []
+  root    = os.path.realpath(directory)
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    pending = {pool.submit(scan_dir, root, matcher)}
+    while pending:
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        found, subdirs = future.result()
+        matches.extend(found)
+        for subdir in subdirs:
+          pending.add(pool.submit(scan_dir, subdir, matcher))
+  return matches
+
+def scan_dir(path, matcher):
+  found   = []
+  subdirs = []
+  try:
+    with os.scandir(path) as it:
+      for entry in it:
+        try:
+          if entry.is_dir():
+            if not entry.is_symlink() and not matcher.prune(entry.path):
+              subdirs.append(entry.path)
+          elif entry.is_symlink():
+            filename = os.path.realpath(entry.path)
+            if matcher(filename):
+              found.append(filename)
+          elif matcher(entry.path):
+            found.append(entry.path)
+        except OSError:
+          pass
+  except OSError:
+    pass
+  return found, subdirs
+
+class Matcher:
+  '''include/exclude terms, lowercased once per query'''
+  def __init__(self, pattern):
+    pattern      = {i.lower() for i in pattern if i} | {'-.git'}
+    self.include = [i for i in pattern if i[0] != '-']
+    self.exclude = [i[1:] for i in pattern if i[0] == '-' and len(i) > 1]
+    if self.exclude:
+      self.excluded = re.compile('|'.join(map(re.escape, self.exclude))).search
+    else:
+      self.excluded = lambda filename: None
+
+  def __call__(self, filename):
+    filename = filename.lower()
+    if self.excluded(filename):
       return False
-  return True
-
-def extract(filename):
-  files = []
-  tmp_file = tempfile.mkdtemp()
-  with zipfile.ZipFile(filename, 'r') as zip_ref:
-    for i in zip_ref.namelist():
-      ext = '.' + i.rpartition('.')[2].lower()
-      if ext in ['.png', '.jpg', '.gif']:
-        zip_ref.extract(i, tmp_file)
-        files.append(os.path.join(tmp_file, i))
-  return files
+    for i in self.include:
+      if i not in filename:
+        return False
+    return True
+
+  def prune(self, directory):
+    # every file below contains the directory's path
+    return self.excluded(directory.lower() + os.sep) is not None
+
+def match(filename, pattern):
+  return Matcher(pattern)(filename)
+
+image_exts = ('.png', '.jpg', '.jpeg', '.gif')
+zip_magic  = (b'PK\x03\x04', b'PK\x05\x06')
+
+def is_archive(filename):
+  try:
+    with open(filename, 'rb') as f:
+      return f.read(4) in zip_magic
+  except OSError:
+    return False
+
+def extract(filename, budget=None):
+  return Archive(filename, budget)
+
+class Archive:
+  '''
+  image members of a zip, read straight out of the archive when needed
+
+  use as a context manager so the zip is closed once uploads are done
+  '''
+  def __init__(self, filename, budget=None):
+    self.zip     = zipfile.ZipFile(filename, 'r')
+    self.budget  = budget
+    self.members = []
+    for info in self.zip.infolist():
+      ext = os.path.splitext(info.filename)[1].lower()
+      if not info.filename.endswith('/') and ext in image_exts:
+        self.members.append(ArchiveMember(self, info))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.zip.close()
+
+class ArchiveMember:
+  def __init__(self, archive, info):
+    self.archive = archive
+    self.info    = info
+    self.name    = info.filename
+
+  @contextmanager
+  def open(self):
+    budget = self.archive.budget
+    size   = budget.reserve(self.info.file_size) if budget else 0
+    try:
+      with self.archive.zip.open(self.info) as f:
+        yield f
+    finally:
+      if budget:
+        budget.release(size)
+
+class Budget:
+  '''byte cap shared by threads holding archive members in memory'''
+  def __init__(self, limit):
+    self.limit = limit
+    self.used  = 0
+    self.cond  = threading.Condition()
+
+  def reserve(self, size):
+    # a member bigger than the cap still gets through, just on its own
+    size = min(size, self.limit)
+    with self.cond:
+      self.cond.wait_for(lambda: self.used + size <= self.limit)
+      self.used += size
+    return size
+
+  def release(self, size):
+    with self.cond:
+      self.used -= size
+      self.cond.notify_all()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+'''
+offline JMdict/EDICT lookups for .jisho
+
+build an index once with:
+  python3 -m cogs.utils.jmdict JMdict_e.gz configs/jmdict.idx
+
+the index is one file: a header, a table of fixed size records sorted by
+key, the key bytes and the entries as json. it is memory mapped and
+searched with a binary search, records carry what results are ranked by,
+so a lookup only decodes the entries it returns.
+'''
+
+import re
+import sys
+import gzip
+import json
+import mmap
+import heapq
+import struct
+import xml.etree.ElementTree as etree
+
+MAGIC  = b'JMDX\x00\x00\x00\x02'
+HEADER = struct.Struct('<8sQQQQ') # magic, records, table, keys, entries
+RECORD = struct.Struct('<IIIIB')  # key offset, key length, entry off, length,
+                                  # common word
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+def normalize(text):
+  return ' '.join(text.lower().split())
+
+class Dictionary:
+  def __init__(self, path):
+    self.file = open(path, 'rb')
+    self.map  = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, self.size, self.table, self.keys, self.entries = \
+                                               HEADER.unpack_from(self.map, 0)
+    if magic != MAGIC:
+      self.close()
+      raise ValueError('{} is not a jmdict index of this version, '
+                       'build it again'.format(path))
+
+  def close(self):
+    self.map.close()
+    self.file.close()
+
+  def record(self, i):
+    return RECORD.unpack_from(self.map, self.table + i*RECORD.size)
+
+  def key(self, i):
+    offset, length, _, _, _ = self.record(i)
+    start = self.keys + offset
+    return self.map[start:start+length]
+
+  def entry(self, offset, length):
+    start = self.entries + offset
+    return json.loads(self.map[start:start+length].decode('utf-8'))
+
+  def lookup(self, query, limit=10, scan=2000):
+    '''
+    entries with a word, reading or english gloss starting with query
+
+    exact matches come first, then common words, then shorter keys.
+    entries are shaped like asyncjisho results
+    '''
+    prefix = normalize(query).encode('utf-8')
+    if not prefix:
+      return []
+
+    lo, hi = 0, self.size
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.key(mid) < prefix:
+        lo = mid + 1
+      else:
+        hi = mid
+
+    found = {} # entry offset -> (rank, length)
+    for i in range(lo, min(lo + scan, self.size)):
+      key = self.key(i)
+      if not key.startswith(prefix):
+        break
+      _, _, offset, length, common = self.record(i)
+      rank = (key != prefix, not common, len(key))
+      if offset not in found or rank < found[offset][0]:
+        found[offset] = (rank, length)
+
+    best    = heapq.nsmallest(limit, found.items(), key=lambda f: f[1][0])
+    entries = []
+    for offset, (rank, length) in best:
+      entry = self.entry(offset, length)
+      entry.pop('common', None)
+      entries.append(entry)
+    return entries
+
+def build(source, target, encoding=None):
+  '''write an index for a JMdict xml or EDICT file (optionally gzipped)'''
+  opener = gzip.open if source.endswith('.gz') else open
+  with opener(source, 'rb') as f:
+    xml = f.read(5) == b'<?xml'
+
+  with opener(source, 'rb') as f:
+    if xml:
+      entries = parse_jmdict(f)
+    else:
+      lines   = (i.decode(encoding or 'euc-jp', 'replace') for i in f)
+      entries = parse_edict(lines)
+
+    keys = []
+    blob = bytearray()
+    for entry in entries:
+      data   = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+      offset = len(blob)
+      blob  += data
+      for key in entry_keys(entry):
+        keys.append((key.encode('utf-8'), offset, len(data),
+                     bool(entry['common'])))
+
+  keys.sort()
+  key_blob = bytearray()
+  table    = bytearray()
+  for key, offset, length, common in keys:
+    table    += RECORD.pack(len(key_blob), len(key), offset, length, common)
+    key_blob += key
+
+  table_off   = HEADER.size
+  keys_off    = table_off + len(table)
+  entries_off = keys_off + len(key_blob)
+  with open(target, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, len(keys), table_off, keys_off, entries_off))
+    f.write(table)
+    f.write(key_blob)
+    f.write(blob)
+  return len(keys)
+
+def entry_keys(entry):
+  keys = set(entry['words'] + entry['readings'])
+  for gloss in entry['english']:
+    gloss = normalize(gloss)
+    keys.add(gloss)
+    if gloss.startswith('to '):
+      keys.add(gloss[3:])
+  return {normalize(key) for key in keys if key.strip()}
+
+def parse_jmdict(f):
+  for event, elem in etree.iterparse(f):
+    if elem.tag != 'entry':
+      continue
+    entry = {
+      'english'         : [],
+      'parts_of_speech' : [],
+      'words'           : [i.text for i in elem.iter('keb')],
+      'readings'        : [i.text for i in elem.iter('reb')],
+      'common'          : elem.find('.//ke_pri') is not None or
+                          elem.find('.//re_pri') is not None
+    }
+    for gloss in elem.iter('gloss'):
+      if gloss.get(XML_LANG, 'eng') == 'eng' and gloss.text:
+        entry['english'].append(gloss.text)
+    for pos in elem.iter('pos'):
+      if pos.text and pos.text not in entry['parts_of_speech']:
+        entry['parts_of_speech'].append(pos.text)
+    elem.clear()
+    yield entry
+
+edict_line = re.compile(r'^(\S+)(?: \[([^\]]*)\])? /(.*)/\s*$')
+edict_tags = re.compile(r'^\s*\(([^)]*)\)')
+
+def parse_edict(lines):
+  for line in lines:
+    m = edict_line.match(line)
+    if not m or line.startswith('　'): # header line
+      continue
+    strip_notes = lambda text: [re.sub(r'\(.*?\)', '', i) for i in
+                                text.split(';') if i]
+    if m.group(2) is None:
+      words, readings = [], strip_notes(m.group(1))
+    else:
+      words, readings = strip_notes(m.group(1)), strip_notes(m.group(2))
+
+    entry = {
+      'english'         : [],
+      'parts_of_speech' : [],
+      'words'           : words,
+      'readings'        : readings,
+      'common'          : '(P)' in m.group(3).split('/')
+    }
+    for gloss in m.group(3).split('/'):
+      if not gloss or gloss == '(P)' or gloss.startswith('EntL'):
+        continue
+      tag = edict_tags.match(gloss)
+      while tag:
+        for pos in tag.group(1).split(','):
+          if not pos.isdigit() and pos not in entry['parts_of_speech']:
+            entry['parts_of_speech'].append(pos)
+        gloss = gloss[tag.end():]
+        tag   = edict_tags.match(gloss)
+      if gloss.strip():
+        entry['english'].append(gloss.strip())
+    yield entry
+
+if __name__ == '__main__':
+  if len(sys.argv) < 3:
+    print('usage: {} <JMdict or EDICT file> <index file> [encoding]'.format(
+           sys.argv[0]
+    ))
+    sys.exit(1)
+  print('{} keys written'.format(build(*sys.argv[1:4])))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import hashlib
+import mimetypes
+import asyncio
+import pathlib
+import tempfile
+import aiohttp
+from aiohttp import web
+
+class MediaStore:
+  '''files on disk named by the sha1 of their content'''
+  valid_name = re.compile(r'^[0-9a-f]{40}(\.[0-9a-z]{1,5})?$')
+
+  def __init__(self, root):
+    self.root = root
+    if not os.path.exists(root):
+      os.makedirs(root)
+
+  def path(self, name):
+    return os.path.join(self.root, name[:2], name)
+
+  def find(self, name):
+    if not self.valid_name.match(name):
+      return None
+    path = self.path(name)
+    return path if os.path.isfile(path) else None
+
+  def store(self, f):
+    '''copy file-like f into the store, returns its name'''
+    ext = os.path.splitext(getattr(f, 'name', ''))[1].lower()
+    if not re.match(r'^\.[0-9a-z]{1,5}$', ext):
+      ext = ''
+
+    hasher  = hashlib.sha1()
+    fd, tmp = tempfile.mkstemp(dir=self.root)
+    try:
+      with os.fdopen(fd, 'wb') as out:
+        for chunk in iter(lambda: f.read(2**16), b''):
+          hasher.update(chunk)
+          out.write(chunk)
+      name = hasher.hexdigest() + ext
+      path = self.path(name)
+      if os.path.exists(path):
+        os.remove(tmp)
+      else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+    except:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+      raise
+    return name
+
+class MediaServer:
+  '''
+  serves a MediaStore over http at /media/<name>
+
+  names never change content, so responses are cacheable forever.
+  if-modified-since requests are answered by aiohttp's FileSender
+  '''
+  cache_control = 'public, max-age=31536000, immutable'
+
+  def __init__(self, store, host='0.0.0.0', port=8080):
+    self.store  = store
+    self.host   = host
+    self.port   = port
+    self.sender = aiohttp.FileSender(resp_factory=lambda: web.StreamResponse(
+                    headers={'Cache-Control' : self.cache_control}
+    ))
+    self.server = None
+
+  async def start(self):
+    loop         = asyncio.get_event_loop()
+    self.app     = web.Application(loop=loop)
+    self.app.router.add_get('/media/{name}', self.handle)
+    self.app.router.add_route('HEAD', '/media/{name}', self.handle)
+    self.handler = self.app.make_handler()
+    self.server  = await loop.create_server(self.handler, self.host,
+                                            self.port
+    )
+
+  async def stop(self):
+    if self.server:
+      self.server.close()
+      await self.server.wait_closed()
+      await self.app.shutdown()
+      await self.handler.finish_connections(5)
+      await self.app.cleanup()
+      self.server = None
+
+  async def handle(self, request):
+    name = request.match_info['name']
+    path = self.store.find(name)
+    if not path:
+      raise web.HTTPNotFound()
+
+    if request.method != 'HEAD':
+      return await self.sender.send(request, pathlib.Path(path))
+
+    # FileSender would write the body even to a HEAD request
+    resp = web.StreamResponse(headers={'Cache-Control' : self.cache_control})
+    resp.content_type   = mimetypes.guess_type(path)[0] or \
+                          'application/octet-stream'
+    resp.content_length = os.path.getsize(path)
+    await resp.prepare(request)
+    return resp
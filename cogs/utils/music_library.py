@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import bisect
+import threading
+from cogs.utils.cache import LRUCache
+
+# field, weight of a term found in it (doubled when it is a whole word)
+fields = (
+  ('name',         8),
+  ('artists',      4),
+  ('album_artist', 3),
+  ('album',        3),
+  ('playlists',    2),
+  ('path',         1)
+)
+
+def track_record(data):
+  '''the parts of an emby Audio item that music searches and plays with'''
+  return {
+    'id'           : data['Id'],
+    'name'         : data.get('Name') or '',
+    'index'        : data.get('IndexNumber'),
+    'artists'      : data.get('Artists') or [],
+    'artist_ids'   : [i['Id'] for i in data.get('ArtistItems') or []],
+    'album'        : data.get('Album') or '',
+    'album_id'     : data.get('AlbumId') or '',
+    'album_artist' : data.get('AlbumArtist') or '',
+    'path'         : data.get('Path') or '',
+    'runtime'      : (data.get('RunTimeTicks') or 0) // 10**7
+  }
+
+def track_order(track):
+  return (track['album_artist'].lower(), track['album'].lower(),
+          track['index'] or 0, track['name'].lower())
+
+class SearchIndex:
+  '''
+  ranked search over a snapshot of the library's tracks
+
+  search terms never contain whitespace, so a term is a substring of a
+  field exactly when it is a substring of one of the field's words. terms
+  are found in the vocabulary (one string, searched with str.find) and the
+  postings of the words they hit give the tracks and fields matched.
+  '''
+  def __init__(self, library):
+    self.tracks = sorted(library.tracks.values(), key=track_order)
+    self.ids    = {} # lowered track, album, artist or playlist id -> positions
+    postings    = {} # word -> {position : field bits}
+    for pos, track in enumerate(self.tracks):
+      keys = [track['id'], track['album_id'], *track['artist_ids'],
+              *library.member_of.get(track['id'], ())]
+      for key in keys:
+        if key:
+          self.ids.setdefault(key.lower(), set()).add(pos)
+      texts = dict(track,
+        artists   = ' '.join(track['artists']),
+        playlists = ' '.join(library.playlist_names(track['id']))
+      )
+      for bit, (field, weight) in enumerate(fields):
+        for word in texts[field].lower().split():
+          hits = postings.setdefault(word, {})
+          hits[pos] = hits.get(pos, 0) | 1 << bit
+
+    self.words    = sorted(postings)
+    self.postings = [postings[word] for word in self.words]
+    self.starts   = []
+    offset        = 0
+    for word in self.words:
+      self.starts.append(offset)
+      offset += len(word) + 1
+    self.vocab    = '\n'.join(self.words)
+    self.weights  = [sum(w for b, (f, w) in enumerate(fields) if bits >> b & 1)
+                     for bits in range(1 << len(fields))]
+    self.terms    = LRUCache(max_entries=256) # term -> hits
+
+  def hits(self, term):
+    '''position -> score of one (lowered) term, for every track it is in'''
+    found = self.terms.get(term)
+    if found is not None:
+      return found
+    found = {}
+    start = self.vocab.find(term)
+    while start >= 0:
+      i     = bisect.bisect_right(self.starts, start) - 1
+      whole = self.words[i] == term
+      for pos, bits in self.postings[i].items():
+        score = self.weights[bits] * (2 if whole else 1)
+        if score > found.get(pos, 0):
+          found[pos] = score
+      if i + 1 >= len(self.starts):
+        break
+      start = self.vocab.find(term, self.starts[i+1])
+    self.terms.put(term, found)
+    return found
+
+  def search(self, terms):
+    '''
+    [(score, track)] best first, for tracks having every term and no -term
+
+    a term that is the id of a track, or of its album, artist or playlist,
+    selects the track on its own and ranks it above everything else.
+    with no positive terms every track matches (with a score of 0)
+    '''
+    terms     = {term.lower() for term in terms if term and term != '-'}
+    positive  = [term for term in terms if term[0] != '-']
+    negative  = [term[1:] for term in terms if term[0] == '-']
+
+    by_id = set()
+    for term in terms:
+      by_id |= self.ids.get(term, set())
+
+    scores = None
+    for term in positive:
+      if term in self.ids:
+        continue
+      hits = self.hits(term)
+      if scores is None:
+        scores = dict(hits)
+      else:
+        scores = {pos : score + hits[pos] for pos, score in scores.items()
+                                          if pos in hits}
+    if scores is None:
+      scores = {} if by_id else dict.fromkeys(range(len(self.tracks)), 0)
+    for term in negative:
+      for pos in self.hits(term):
+        scores.pop(pos, None)
+
+    top = max(scores.values(), default=0) + 1
+    for pos in by_id:
+      scores[pos] = top
+    # positions follow track_order, which breaks ties between equal scores
+    ranked = sorted(scores) if positive or by_id else scores
+    if positive or by_id:
+      ranked.sort(key=scores.__getitem__, reverse=True)
+    return [(scores[pos], self.tracks[pos]) for pos in ranked]
+
+class Library:
+  '''
+  local mirror of emby's audio items and playlists
+
+  sync fetches only what emby saved since the last sync, a full sync
+  (every full_every seconds) also drops what was deleted
+  '''
+  page  = 1000
+  slack = 120 # seconds, for clock differences between bot and server
+
+  def __init__(self, filename, conn, full_every=86400):
+    self.filename   = filename
+    self.conn       = conn
+    self.full_every = full_every
+    self.lock       = threading.RLock()
+    self.tracks     = {} # id -> track record
+    self.playlists  = {} # id -> {'name':..., 'etag':..., 'items':[ids]}
+    self.member_of  = {} # track id -> set of playlist ids
+    self.synced     = 0
+    self.full       = 0
+    self.index      = None
+    self.load()
+
+  def __len__(self):
+    return len(self.tracks)
+
+  def items(self, **query):
+    start = 0
+    while True:
+      data = self.conn.connector.getJson('/Users/{UserId}/Items', remote=False,
+                                         Recursive=True, StartIndex=start,
+                                         Limit=self.page, **query
+      )
+      items = data.get('Items', [])
+      for item in items:
+        yield item
+      start += len(items)
+      if not items or start >= data.get('TotalRecordCount', 0):
+        break
+
+  def sync(self, full=False):
+    '''bring the mirror up to date (blocking), returns True if it changed'''
+    started = time.time()
+    full    = full or not self.tracks or started - self.full > self.full_every
+    query   = {
+      'IncludeItemTypes' : 'Audio',
+      'Fields'           : 'Path'
+    }
+    if not full:
+      query['MinDateLastSaved'] = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                        time.gmtime(self.synced - self.slack))
+
+    fetched = {item['Id'] : track_record(item) for item in self.items(**query)}
+    changed = self.sync_playlists()
+    with self.lock:
+      old = self.tracks
+      if full:
+        changed |= set(old) != set(fetched)
+        self.tracks = {}
+        self.full   = started
+      for track_id, track in fetched.items():
+        changed |= old.get(track_id) != track
+        self.tracks[track_id] = track
+      self.synced = started
+      if changed or not self.index:
+        self.index = SearchIndex(self)
+    if changed:
+      self.save()
+    return changed
+
+  def search(self, terms):
+    '''ranked [(score, track)] for search terms, see SearchIndex.search'''
+    with self.lock:
+      index = self.index or SearchIndex(self)
+      self.index = index
+    return index.search(terms)
+
+  def sync_playlists(self):
+    changed = False
+    found   = {}
+    for data in self.items(IncludeItemTypes='Playlist', Fields='Etag'):
+      playlist = self.playlists.get(data['Id'])
+      etag     = data.get('Etag') or data.get('DateModified')
+      if not playlist or not etag or playlist['etag'] != etag:
+        playlist = {
+          'name'  : data.get('Name') or '',
+          'etag'  : etag,
+          'items' : [i['Id'] for i in self.items(ParentId=data['Id'],
+                                                 IncludeItemTypes='Audio')]
+        }
+        changed = True
+      found[data['Id']] = playlist
+
+    with self.lock:
+      changed |= set(found) != set(self.playlists)
+      self.playlists = found
+      self.index_playlists()
+    return changed
+
+  def index_playlists(self):
+    self.member_of = {}
+    for playlist_id, playlist in self.playlists.items():
+      for track_id in playlist['items']:
+        self.member_of.setdefault(track_id, set()).add(playlist_id)
+
+  def playlist_names(self, track_id):
+    return [self.playlists[i]['name'] for i in self.member_of.get(track_id, ())]
+
+  def load(self):
+    try:
+      with open(self.filename, 'r') as f:
+        data = json.load(f)
+    except:
+      return
+    with self.lock:
+      self.tracks    = {track['id'] : track for track in data['tracks']}
+      self.playlists = data['playlists']
+      self.synced    = data['synced']
+      self.full      = data['full']
+      self.index_playlists()
+      self.index     = SearchIndex(self)
+
+  def save(self):
+    # searches only wait for the snapshot, not for the disk
+    with self.lock:
+      data = {
+        'synced'    : self.synced,
+        'full'      : self.full,
+        'tracks'    : list(self.tracks.values()),
+        'playlists' : dict(self.playlists)
+      }
+    tmp = self.filename + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(data, f)
+    os.replace(tmp, self.filename)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+import random
+import asyncio
+
+class QueueEntry:
+  '''a queued song, only ids so that queues stay small and can be saved'''
+  __slots__ = ('item_id', 'requester_id')
+
+  def __init__(self, item_id, requester_id):
+    self.item_id      = item_id
+    self.requester_id = requester_id
+
+  def to_list(self):
+    return [self.item_id, self.requester_id]
+
+class Node:
+  __slots__ = ('entry', 'priority', 'size', 'left', 'right')
+
+  def __init__(self, entry):
+    self.entry    = entry
+    self.priority = random.random()
+    self.size     = 1
+    self.left     = None
+    self.right    = None
+
+def size(node):
+  return node.size if node else 0
+
+def update(node):
+  node.size = 1 + size(node.left) + size(node.right)
+  return node
+
+def split(node, i):
+  '''(first i nodes, the rest)'''
+  if node is None:
+    return None, None
+  if size(node.left) < i:
+    left, right = split(node.right, i - size(node.left) - 1)
+    node.right  = left
+    return update(node), right
+  left, right = split(node.left, i)
+  node.left   = right
+  return left, update(node)
+
+def merge(left, right):
+  if left is None or right is None:
+    return left or right
+  if left.priority > right.priority:
+    left.right = merge(left.right, right)
+    return update(left)
+  right.left = merge(left, right.left)
+  return update(right)
+
+def walk(node):
+  stack = []
+  while stack or node:
+    if node:
+      stack.append(node)
+      node = node.left
+    else:
+      node = stack.pop()
+      yield node.entry
+      node = node.right
+
+class IndexedDeque:
+  '''
+  a sequence with O(log n) indexing, insertion and removal at any position
+
+  it is an implicit treap: a tree ordered by position, where each node
+  knows the size of its subtree
+  '''
+  def __init__(self, entries=()):
+    self.root = None
+    for entry in entries:
+      self.append(entry)
+
+  def __len__(self):
+    return size(self.root)
+
+  def __iter__(self):
+    return walk(self.root)
+
+  def index(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('queue index out of range')
+    return i
+
+  def __getitem__(self, i):
+    i    = self.index(i)
+    node = self.root
+    while True:
+      if i < size(node.left):
+        node = node.left
+      elif i == size(node.left):
+        return node.entry
+      else:
+        i   -= size(node.left) + 1
+        node = node.right
+
+  def slice(self, start, stop):
+    left, rest    = split(self.root, start)
+    middle, right = split(rest, max(stop - start, 0))
+    entries       = list(walk(middle))
+    self.root     = merge(merge(left, middle), right)
+    return entries
+
+  def insert(self, i, entry):
+    left, right = split(self.root, max(0, min(i, len(self))))
+    self.root   = merge(merge(left, Node(entry)), right)
+
+  def append(self, entry):
+    self.root = merge(self.root, Node(entry))
+
+  def pop(self, i=-1):
+    i            = self.index(i)
+    left, rest   = split(self.root, i)
+    node, right  = split(rest, 1)
+    self.root    = merge(left, right)
+    return node.entry
+
+  def popleft(self):
+    return self.pop(0)
+
+  def move(self, i, j):
+    '''move the entry at i so that it ends up at j'''
+    self.insert(j, self.pop(i))
+
+  def shuffle(self):
+    entries   = list(self)
+    random.shuffle(entries)
+    self.root = None
+    for entry in entries:
+      IndexedDeque.append(self, entry)
+
+  def clear(self):
+    self.root = None
+
+class MusicQueue(IndexedDeque):
+  '''
+  a server's queue of QueueEntries
+
+  get waits for a song like asyncio.Queue.get does, on_change(queue) is
+  called after every change so the queue can be saved
+  '''
+  def __init__(self, entries=(), on_change=None):
+    super(MusicQueue, self).__init__(entries)
+    self.added     = asyncio.Event()
+    self.on_change = on_change
+
+  def changed(self):
+    if self:
+      self.added.set()
+    if self.on_change:
+      self.on_change(self)
+
+  async def get(self):
+    while not self:
+      self.added.clear()
+      await self.added.wait()
+    entry = IndexedDeque.pop(self, 0)
+    self.changed()
+    return entry
+
+  def put(self, entries):
+    for entry in entries:
+      IndexedDeque.append(self, entry)
+    self.changed()
+
+  def pop(self, i=-1):
+    entry = super(MusicQueue, self).pop(i)
+    self.changed()
+    return entry
+
+  def move(self, i, j):
+    IndexedDeque.insert(self, j, IndexedDeque.pop(self, i))
+    self.changed()
+
+  def shuffle(self):
+    super(MusicQueue, self).shuffle()
+    self.changed()
+
+  def dedupe(self):
+    '''drop every entry whose song is already queued earlier, returns count'''
+    seen    = set()
+    entries = []
+    for entry in self:
+      if entry.item_id not in seen:
+        seen.add(entry.item_id)
+        entries.append(entry)
+    removed   = len(self) - len(entries)
+    self.root = None
+    for entry in entries:
+      IndexedDeque.append(self, entry)
+    self.changed()
+    return removed
+
+  def clear(self):
+    super(MusicQueue, self).clear()
+    self.changed()
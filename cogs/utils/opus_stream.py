@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+'''
+playing opus sources without decoding them
+
+ffmpeg only remuxes the source's opus stream into ogg (or encodes other
+sources to opus once), the packets are pulled out of the ogg pages here
+and sent to discord as they are. a Broadcast shares one ffmpeg's packets
+between every server playing the same song
+'''
+
+import time
+import shlex
+import itertools
+import threading
+import subprocess
+from collections import deque
+
+# milliseconds per frame, by the config number in a packet's toc byte
+frame_ms = [10, 20, 40, 60] * 3 + [10, 20] * 2 + [2.5, 5, 10, 20] * 4
+
+def packet_samples(packet):
+  '''48kHz samples in one opus packet'''
+  toc   = packet[0]
+  count = toc & 3
+  if count == 3:
+    frames = packet[1] & 0x3f
+  else:
+    frames = 1 if count == 0 else 2
+  return int(frame_ms[toc >> 3] * 48 * frames)
+
+def read_exact(stream, size):
+  data = b''
+  while len(data) < size:
+    chunk = stream.read(size - len(data))
+    if not chunk:
+      break
+    data += chunk
+  return data
+
+def packets(stream):
+  '''the audio packets of an ogg opus stream, headers skipped'''
+  partial = b''
+  while True:
+    header = read_exact(stream, 27)
+    if len(header) < 27:
+      return
+    if header[:4] != b'OggS':
+      raise ValueError('not an ogg stream')
+    table = read_exact(stream, header[26])
+    data  = read_exact(stream, sum(table))
+    offset = 0
+    for size in table:
+      partial += data[offset:offset+size]
+      offset  += size
+      if size < 255:
+        if partial and not partial.startswith((b'OpusHead', b'OpusTags')):
+          yield partial
+        partial = b''
+
+def spawn(url, before_options='', bitrate=None, executable='ffmpeg'):
+  '''
+  ffmpeg writing the first audio stream of url as ogg opus to stdout
+
+  the stream is copied as it is, unless a bitrate (kbps) to encode at is given
+  '''
+  if bitrate:
+    codec = ['-c:a', 'libopus', '-b:a', '{}k'.format(bitrate), '-ar', '48000']
+  else:
+    codec = ['-c:a', 'copy']
+  args = [executable, *shlex.split(before_options), '-i', url, '-vn',
+          '-map', '0:a:0', *codec, '-f', 'ogg', '-loglevel', 'warning',
+          'pipe:1'
+  ]
+  return subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE
+  )
+
+def finish(process, complete):
+  '''end an ffmpeg, letting it exit on its own if its output was all read'''
+  if complete:
+    try:
+      process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+      pass
+  process.kill()
+  if process.poll() is None:
+    process.communicate()
+  return complete and process.returncode == 0
+
+class Broadcast:
+  '''
+  the packets of one ffmpeg, read once for any number of subscriptions
+
+  packets stay buffered until every subscription has read them, up to
+  buffer packets. with the buffer full, ffmpeg is only held back for
+  subscriptions that are reading, see make_room. one that has not read
+  for stall seconds (paused?) has its oldest packets dropped instead of
+  holding everyone up. new subscriptions start at the oldest buffered
+  packet: the beginning of the song if it is still held, mid-stream
+  otherwise. ffmpeg is stopped once nobody is subscribed
+  '''
+  stall = 2
+  def __init__(self, process, stream=None, recorder=None, buffer=30000,
+               on_idle=None):
+    self.process       = process
+    self.stream        = stream or process.stdout
+    self.recorder      = recorder
+    self.buffer        = buffer
+    self.on_idle       = on_idle
+    self.packets       = deque()
+    self.base          = 0     # position of packets[0] in the song
+    self.subscriptions = set()
+    self.waiting       = 0     # subscriptions waiting for the next packet
+    self.ended         = False # no more packets will come
+    self.stopped       = False
+    self.complete      = False # ffmpeg gave every packet, and exited cleanly
+    self.cond          = threading.Condition()
+    self.thread        = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def __len__(self):
+    return len(self.subscriptions)
+
+  @property
+  def idle(self):
+    return self.stopped or (self.ended and not self.subscriptions)
+
+  def subscribe(self):
+    with self.cond:
+      sub = Subscription(self, self.base)
+      self.subscriptions.add(sub)
+      return sub
+
+  def unsubscribe(self, sub):
+    with self.cond:
+      self.subscriptions.discard(sub)
+      self.cond.notify_all()
+      if self.subscriptions:
+        return
+      self.stopped = not self.ended
+    if self.stopped:
+      self.process.kill() # also wakes the reader thread up
+    if self.on_idle:
+      self.on_idle(self)
+
+  def run(self):
+    complete = False
+    try:
+      for packet in packets(self.stream):
+        with self.cond:
+          self.make_room()
+          if self.stopped:
+            break
+          self.packets.append(packet)
+          self.cond.notify_all()
+      else:
+        complete = True
+    except Exception:
+      pass
+    finally:
+      self.complete = finish(self.process, complete and not self.stopped)
+      if self.recorder:
+        self.recorder.close(self.complete)
+      with self.cond:
+        self.ended = True
+        self.cond.notify_all()
+        idle = not self.subscriptions
+      if idle and self.on_idle:
+        self.on_idle(self)
+
+  def make_room(self):
+    '''
+    called before adding a packet: with the buffer full, drop what everyone
+    has read. if the rest is still needed, wait for subscriptions that are
+    reading behind. laggards that are not reading (paused?), or that hold
+    up a subscription waiting for more, lose their oldest half buffer at
+    once: they skip ahead one time instead of stuttering
+    '''
+    while len(self.packets) >= self.buffer and not self.stopped:
+      end = self.base + len(self.packets)
+      self.drop(min((sub.pos for sub in self.subscriptions), default=end))
+      if len(self.packets) < self.buffer:
+        return
+      now  = time.monotonic()
+      half = self.base + len(self.packets) // 2
+      if self.waiting or not any(now - sub.read_at < self.stall
+                                 for sub in self.subscriptions
+                                 if sub.pos < half):
+        self.drop(half)
+        return
+      self.cond.wait(0.5)
+
+  def drop(self, pos):
+    while self.base < pos and self.packets:
+      self.packets.popleft()
+      self.base += 1
+    for sub in self.subscriptions:
+      sub.pos = max(sub.pos, self.base)
+
+class Subscription:
+  '''one reader of a Broadcast, iterating it gives the packets'''
+  def __init__(self, broadcast, pos):
+    self.broadcast = broadcast
+    self.pos       = pos
+    self.read_at   = time.monotonic()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    b = self.broadcast
+    with b.cond:
+      while self.pos >= b.base + len(b.packets) and not b.ended:
+        b.waiting += 1
+        b.cond.notify_all() # the reader may be waiting on a laggard
+        try:
+          b.cond.wait()
+        finally:
+          b.waiting -= 1
+      self.pos = max(self.pos, b.base) # skip what was dropped
+      if self.pos >= b.base + len(b.packets):
+        raise StopIteration
+      packet       = b.packets[self.pos - b.base]
+      self.pos    += 1
+      self.read_at = time.monotonic()
+      if len(b.packets) >= b.buffer:
+        b.cond.notify_all()
+      return packet
+
+  def close(self):
+    self.broadcast.unsubscribe(self)
+
+class Multiplexer:
+  '''the running Broadcasts by song, so each song is streamed only once'''
+  def __init__(self, buffer=30000):
+    self.buffer     = buffer
+    self.broadcasts = {}
+    self.lock       = threading.Lock()
+
+  def subscribe(self, key, spawn):
+    '''
+    a Subscription to key's broadcast
+
+    spawn() -> (process, stream, recorder) starts one if none is running
+    '''
+    with self.lock:
+      broadcast = self.broadcasts.get(key)
+      if broadcast is None or broadcast.idle:
+        process, stream, recorder = spawn()
+        broadcast = Broadcast(process, stream, recorder, self.buffer,
+                              on_idle=lambda b: self.discard(key, b)
+        )
+        self.broadcasts[key] = broadcast
+      return broadcast.subscribe()
+
+  def discard(self, key, broadcast):
+    with self.lock:
+      if self.broadcasts.get(key) is broadcast:
+        del self.broadcasts[key]
+
+class OpusPlayer(threading.Thread):
+  '''
+  a player (like the one create_ffmpeg_player makes) for opus packets
+
+  source is any iterable of packets, like packets() of a file or a
+  Subscription. the volume can not change since nothing is decoded
+  '''
+  samples_per_frame = 960 # what the voice client advances timestamps by
+
+  def __init__(self, source, client, after=None, process=None):
+    threading.Thread.__init__(self, daemon=True)
+    self.origin    = source
+    self.source    = iter(source)
+    self.client    = client
+    self.after     = after
+    self.process   = process
+    self.volume    = 1.0
+    self.error     = None
+    self.complete  = False # every packet was sent
+    self._end      = threading.Event()
+    self._resumed  = threading.Event()
+    self._resumed.set()
+    self._connected = getattr(client, '_connected', None)
+
+  def preload(self, count=50):
+    '''read the first second of packets ahead, False if there are none'''
+    head        = list(itertools.islice(self.source, count))
+    self.source = itertools.chain(head, self.source)
+    return bool(head)
+
+  def close(self):
+    close = getattr(self.origin, 'close', None)
+    if close:
+      close()
+
+  def run(self):
+    try:
+      self.send_all()
+    except Exception as e:
+      self.error = e
+    finally:
+      self.stop()
+      self.close()
+      if self.after is not None:
+        try:
+          self.after()
+        except:
+          pass
+
+  def send_all(self):
+    start   = time.perf_counter()
+    elapsed = 0.0
+    for packet in self.source:
+      if self._end.is_set():
+        return
+      if not self._resumed.is_set() or \
+         (self._connected and not self._connected.is_set()):
+        self._resumed.wait()
+        if self._connected:
+          self._connected.wait()
+        start = time.perf_counter() - elapsed
+
+      samples = packet_samples(packet)
+      self.client.play_audio(packet, encode=False)
+      if samples != self.samples_per_frame and hasattr(self.client,
+                                                      'checked_add'):
+        self.client.checked_add('timestamp',
+                                samples - self.samples_per_frame, 4294967295)
+      elapsed += samples / 48000
+      time.sleep(max(0, start + elapsed - time.perf_counter()))
+    self.complete = True
+
+  def stop(self):
+    self._end.set()
+    self._resumed.set()
+
+  def pause(self):
+    self._resumed.clear()
+
+  def resume(self):
+    self._resumed.set()
+
+  def is_playing(self):
+    return self._resumed.is_set() and not self.is_done()
+
+  def is_done(self):
+    return not self.is_alive() or self._end.is_set()
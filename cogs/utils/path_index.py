@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import threading
+
+split_words = re.compile(r'[\W_]+')
+
+def words(text):
+  return set(filter(None, split_words.split(text.lower())))
+
+class Directory:
+  __slots__ = ('id', 'path', 'mtime', 'files', 'links', 'subdirs')
+
+  def __init__(self, did, path, mtime=None):
+    self.id      = did
+    self.path    = path
+    self.mtime   = mtime
+    self.files   = {} # name -> file id
+    self.links   = {} # name -> (file id, resolved path)
+    self.subdirs = set()
+
+class PathIndex:
+  '''
+  token index of every file under root
+
+  lowercase words of directory paths map to directory ids, and words of
+  file names map to file ids, so include/exclude terms resolve with set
+  operations instead of walking the tree.
+  directories are rescanned only when their mtime changes
+  '''
+  def __init__(self, root, name=None):
+    self.root       = os.path.realpath(root)
+    self.name       = name
+    self.ready      = False
+    self.lock       = threading.RLock()
+    self.dirs       = {} # path -> Directory
+    self.dir_ids    = {} # dir id -> Directory
+    self.files      = {} # file id -> (Directory, name)
+    self.dir_words  = {} # word -> set of dir ids
+    self.file_words = {} # word -> set of file ids
+    self.next_id    = 0
+    self.load()
+
+  def __len__(self):
+    return len(self.files)
+
+  def path(self, fid):
+    d, name = self.files[fid]
+    link = d.links.get(name)
+    if link:
+      return link[1]
+    return os.path.join(d.path, name)
+
+  def query(self, pattern):
+    include = [i.lower() for i in pattern if i and i[0] != '-']
+    exclude = [i[1:].lower() for i in pattern if len(i) > 1 and i[0] == '-']
+    with self.lock:
+      result = None
+      for term in sorted(include, key=len, reverse=True):
+        result = self.lookup(term, result)
+        if not result:
+          return []
+      if result is None:
+        result = set(self.files)
+      for term in exclude:
+        result -= self.lookup(term, result)
+      return [self.path(fid) for fid in result]
+
+  def lookup(self, term, within=None):
+    '''set of file ids whose path contains term'''
+    pieces = [i for i in split_words.split(term) if i]
+    if not pieces:
+      found = set(self.files if within is None else within)
+    else:
+      key   = max(pieces, key=len)
+      found = set()
+      for word, fids in self.file_words.items():
+        if key in word:
+          found |= fids
+      for word, dids in self.dir_words.items():
+        if key in word:
+          for did in dids:
+            found.update(self.dir_ids[did].files.values())
+      if within is not None:
+        found &= within
+    # terms spanning separators only narrowed the search, confirm them
+    if pieces != [term]:
+      found = {i for i in found if term in self.path(i).lower()}
+    return found
+
+  def refresh(self):
+    '''rescan changed directories, returns True if anything changed'''
+    changed = False
+    seen    = set()
+    stack   = [self.root]
+    while stack:
+      path = stack.pop()
+      try:
+        mtime = os.stat(path).st_mtime_ns
+      except OSError:
+        continue
+      seen.add(path)
+      d = self.dirs.get(path)
+      if d is None or d.mtime != mtime:
+        d = self.scan(path, mtime)
+        changed = True
+      stack.extend(os.path.join(path, i) for i in d.subdirs)
+
+    with self.lock:
+      for path in set(self.dirs) - seen:
+        self.remove_dir(self.dirs[path])
+        changed = True
+      self.ready = True
+    return changed
+
+  def scan(self, path, mtime):
+    files   = set()
+    links   = {}
+    subdirs = set()
+    try:
+      with os.scandir(path) as it:
+        for entry in it:
+          try:
+            if entry.is_dir():
+              if not entry.is_symlink() and entry.name != '.git':
+                subdirs.add(entry.name)
+            elif entry.is_symlink():
+              links[entry.name] = os.path.realpath(entry.path)
+            else:
+              files.add(entry.name)
+          except OSError:
+            pass
+    except OSError:
+      pass
+    return self.update_dir(path, mtime, files, links, subdirs)
+
+  def update_dir(self, path, mtime, files, links, subdirs):
+    with self.lock:
+      d = self.dirs.get(path)
+      if d is None:
+        d = Directory(self.new_id(), path)
+        self.dirs[path]    = d
+        self.dir_ids[d.id] = d
+        for word in words(path):
+          self.dir_words.setdefault(word, set()).add(d.id)
+      d.mtime   = mtime
+      d.subdirs = set(subdirs)
+
+      for name in set(d.files) - files:
+        self.remove_file(d.files.pop(name), name)
+      for name in files - set(d.files):
+        d.files[name] = self.add_file(d, name, name)
+
+      for name in set(d.links):
+        if links.get(name) != d.links[name][1]:
+          fid, target = d.links.pop(name)
+          self.remove_file(fid, target)
+      for name in set(links) - set(d.links):
+        d.links[name] = (self.add_file(d, name, links[name]), links[name])
+      return d
+
+  def remove_dir(self, d):
+    for name in list(d.files):
+      self.remove_file(d.files.pop(name), name)
+    for name in list(d.links):
+      fid, target = d.links.pop(name)
+      self.remove_file(fid, target)
+    for word in words(d.path):
+      discard(self.dir_words, word, d.id)
+    del self.dirs[d.path]
+    del self.dir_ids[d.id]
+
+  def add_file(self, d, name, text):
+    fid = self.new_id()
+    self.files[fid] = (d, name)
+    for word in words(text):
+      self.file_words.setdefault(word, set()).add(fid)
+    return fid
+
+  def remove_file(self, fid, text):
+    for word in words(text):
+      discard(self.file_words, word, fid)
+    del self.files[fid]
+
+  def new_id(self):
+    self.next_id += 1
+    return self.next_id
+
+  def load(self):
+    if not self.name:
+      return
+    try:
+      with open(self.name, 'r') as f:
+        data = json.load(f)
+    except:
+      return
+    if data.get('root') != self.root:
+      return
+    for path, (mtime, files, links, subdirs) in data['dirs'].items():
+      self.update_dir(path, mtime, set(files), dict(links), subdirs)
+    self.ready = bool(self.dirs)
+
+  def save(self):
+    if not self.name:
+      return
+    with self.lock:
+      dirs = {}
+      for path, d in self.dirs.items():
+        links = [[name, link[1]] for name, link in d.links.items()]
+        dirs[path] = [d.mtime, list(d.files), links, list(d.subdirs)]
+    tmp = self.name + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'root':self.root, 'dirs':dirs}, f)
+    os.replace(tmp, self.name)
+
+def discard(postings, word, item):
+  items = postings.get(word)
+  if items is not None:
+    items.discard(item)
+    if not items:
+      del postings[word]
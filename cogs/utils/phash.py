@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import threading
+
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+def available():
+  return Image is not None
+
+def dhash(path, size=8):
+  '''
+  difference hash of an image as a size*size bit int
+
+  survives re-encoding and resizing, so near copies are a few bits apart
+  '''
+  with Image.open(path) as img:
+    img.draft('L', (size*8, size*8)) # let jpeg decode at a fraction of size
+    img = img.convert('L').resize((size+1, size), Image.LANCZOS)
+    pixels = list(img.getdata())
+
+  value = 0
+  for row in range(size):
+    for col in range(size):
+      left  = pixels[row*(size+1) + col]
+      right = pixels[row*(size+1) + col + 1]
+      value = (value << 1) | (left > right)
+  return value
+
+def distance(a, b):
+  return bin(a ^ b).count('1')
+
+class BKTree:
+  '''hashes by hamming distance, for finding every hash within n bits'''
+  def __init__(self, items=()):
+    self.root = None
+    self.size = 0
+    self.lock = threading.Lock()
+    for value, key in items:
+      self.add(value, key)
+
+  def __len__(self):
+    return self.size
+
+  def add(self, value, key):
+    node = [value, key, {}]
+    with self.lock:
+      if self.root is None:
+        self.root = node
+        self.size = 1
+        return
+      current = self.root
+      while True:
+        d = distance(value, current[0])
+        if d == 0 and key == current[1]:
+          return
+        child = current[2].get(d)
+        if child is None:
+          current[2][d] = node
+          self.size += 1
+          return
+        current = child
+
+  def rebuild(self, items):
+    '''replace the contents with (value, key) items, nodes can not be removed'''
+    tree = BKTree(items)
+    with self.lock:
+      self.root, self.size = tree.root, tree.size
+
+  def find(self, value, max_distance):
+    '''[(distance, key)...] within max_distance, closest first'''
+    found = []
+    with self.lock:
+      stack = [self.root] if self.root else []
+      while stack:
+        node = stack.pop()
+        d    = distance(value, node[0])
+        if d <= max_distance:
+          found.append((d, node[1]))
+        for edge, child in node[2].items():
+          if d - max_distance <= edge <= d + max_distance:
+            stack.append(child)
+    return sorted(found)
@@ -1,93 +1,335 @@
-import puush
 import os
 from cogs.utils import find as azfind
+from cogs.utils import phash
+from cogs.utils import web
 from cogs.utils.config import Config
 import requests
 import tempfile
+import threading
+import asyncio
+import time
 import hashlib
+import json
+from cogs.utils.cache import LRUCache, PersistentLRUCache
+from cogs.utils.media_store import MediaStore, MediaServer
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 
 conf = Config('configs/az.json')
 if 'path' not in conf:
   conf['path'] = input('Enter dir to search for: ')
 
-if 'key' not in conf:
-  conf['key'] = input('Enter puush api key: ')
+if 'backend' not in conf:
+  conf['backend'] = 'puush'
 
-account = puush.Account(conf['key'])
+# path -> [size, mtime_ns, md5], so unchanged files are never read twice
+hashes = PersistentLRUCache('configs/file_hashes.json', 'file hashes',
+                            max_entries=conf.get('hash_cache_entries', 200000),
+                            save_delay=conf.get('hash_save_delay', 30)
+)
+if os.path.exists('configs/hashes.json'): # the old, unbounded Config
+  try:
+    with open('configs/hashes.json', 'r') as f:
+      for path, entry in json.load(f).items():
+        LRUCache.put(hashes, path, entry)
+  except (OSError, ValueError, AttributeError):
+    pass
+  hashes.save()
+  os.remove('configs/hashes.json')
 
-if 'images' not in conf or type(conf['images']) != dict:
-  conf['images'] = {}
+# cached urls are trusted for confirm_ttl seconds after they were last seen
+# working, older ones are rechecked on the bot's loop while being served
+loop       = asyncio.get_event_loop()
+validating = set()
 
-account = puush.Account(conf['key'])
+# content hash -> {'url':..., 'checked':...} (or {'pages':[...]} while partial)
+images = PersistentLRUCache('configs/images.json', 'images',
+                            max_entries=conf.get('image_cache_entries', 20000),
+                            max_bytes=conf.get('image_cache_bytes', 8*2**20),
+                            ttl=conf.get('image_ttl'),
+                            sizeof=lambda entry: len(json.dumps(entry)),
+                            save_delay=conf.get('image_save_delay', 5)
+)
+if type(conf.get('images')) == dict:
+  for str_hash, entry in conf['images'].items():
+    LRUCache.put(images, str_hash, entry)
+  images.save()
+  del conf['images']
 
-def upload(paths, p=None):
+class PuushBackend:
+  '''uploads to puush.me'''
+  def __init__(self, conf):
+    import puush
+    if 'key' not in conf:
+      conf['key'] = input('Enter puush api key: ')
+    self.account = puush.Account(conf['key'])
+
+  def upload(self, f):
+    image = self.account.upload(f)
+    return image.url if image else None
+
+class LocalBackend:
+  '''keeps files in a local MediaStore, served by the bot itself'''
+  def __init__(self, conf):
+    if 'local_url' not in conf:
+      conf['local_url'] = input('Enter public url of the media server: ')
+    self.url    = conf['local_url'].rstrip('/')
+    self.store  = MediaStore(conf.get('local_root', 'media'))
+    self.server = MediaServer(self.store, conf.get('local_host', '0.0.0.0'),
+                                          conf.get('local_port', 8080)
+    )
+    loop.create_task(self.server.start())
+
+  def upload(self, f):
+    return '{}/media/{}'.format(self.url, self.store.store(f))
+
+# a backend takes an open file and returns the url it can be viewed at
+backends = {
+  'puush' : PuushBackend,
+  'local' : LocalBackend
+}
+backend = backends[conf['backend']](conf)
+
+# perceptual hashes of uploaded images, so re-encoded or resized copies
+# within phash_distance bits reuse the first one's url. hashes of entries
+# images has dropped stay in it until it is rebuilt, see prune_similar
+def similar_items():
+  return [(entry['phash'], str_hash) for str_hash, entry in images.items()
+                                     if 'phash' in entry]
+
+similar      = phash.BKTree(similar_items())
+similar_lock = threading.Lock()
+stale_hits   = 0
+
+# key (content hash or source url) -> Future of the get_url doing the work
+flights     = {}
+flight_lock = threading.Lock()
+
+# bytes of archive pages that may be held in memory while uploading
+archive_budget = azfind.Budget(conf.get('archive_memory', 64 * 2**20))
+
+def upload(paths, p=None, progress=None, info=None):
+  '''
+  upload every path on a pool of upload_workers threads
+
+  urls of pages that made it are kept in images[p]['pages'] when
+  others fail, so calling again only uploads the missing pages.
+  progress(done, total) is called from the pool as pages finish,
+  info is extra data stored alongside the urls
+  '''
   if not paths:
     return []
   if not p:
     p = get_hash(paths[0])
-  urls = ''
-  for path in paths:
-    for i in range(3):
-      try:
-        image = account.upload(path)
-        if image and image.url:
-          urls += image.url + '\n'
-          break
-      except ValueError:
-        pass
-    else:
-      return 'could not upload image'
-  conf['images'][p] = {'url':urls}
-  conf.save()
+
+  pages = images.peek(p, {}).get('pages')
+  if not pages or len(pages) != len(paths):
+    pages = [None]*len(paths)
+  missing = [i for i, url in enumerate(pages) if not url]
+  done    = len(paths) - len(missing)
+
+  with ThreadPoolExecutor(max_workers=conf.get('upload_workers', 4)) as pool:
+    futures = {pool.submit(upload_page, paths[i]) : i for i in missing}
+    for future in as_completed(futures):
+      url = future.result()
+      if url:
+        pages[futures[future]] = url
+        done += 1
+        if progress:
+          progress(done, len(paths))
+
+  if done < len(paths):
+    images.put(p, {'pages':pages})
+    return 'could not upload {} of {} images, try again to resume'.format(
+            len(paths) - done, len(paths)
+    )
+  urls = ''.join(url + '\n' for url in pages)
+  images.put(p, dict(info or {}, url=urls, checked=time.time()))
   return urls
 
-def get_url(path):
-  tempfiles = []
+def upload_page(page):
+  backoff = conf.get('upload_backoff', 1)
+  for attempt in range(conf.get('upload_retries', 3)):
+    if attempt:
+      time.sleep(backoff * 2**(attempt-1))
+    try:
+      with open_page(page) as f:
+        url = backend.upload(f)
+      if url:
+        return url
+    except (ValueError, OSError, requests.RequestException):
+      pass
+  return None
+
+def open_page(page):
+  if isinstance(page, str):
+    return open(page, 'rb')
+  return page.open()
+
+def get_url(path, progress=None):
   if path.startswith('http'):
-    t   = tempfile.NamedTemporaryFile(suffix=".jpg")
-    response = requests.get(path, stream=True, verify=False)
+    return single_flight(path, get_remote_url, path, progress)
+  return get_file_url(path, get_hash(path), progress)
+
+def get_remote_url(url, progress=None):
+  with tempfile.NamedTemporaryFile(suffix=".jpg") as t:
+    response = web.get_client().requests.get(url, stream=True, verify=False)
     t.write(response.raw.read())
-    path = t.name
-    tempfiles.append(t)
+    t.flush()
+    return get_file_url(t.name, get_hash(t.name, cache=False), progress)
 
-  str_hash = get_hash(path)
+def get_file_url(path, str_hash, progress=None):
+  return cached_url(str_hash) or \
+         single_flight(str_hash, upload_file, path, str_hash, progress)
 
-  if str_hash in conf['images']:
-    urls = conf['images'][str_hash]['url']
-    try:
-      if confirm_img(urls):
-        for t in tempfiles:
-          t.close()
-        return urls
-    except:
-      pass
+def cached_url(str_hash):
+  entry = images.get(str_hash)
+  if entry and entry.get('url'):
+    if time.time() - entry.get('checked', 0) > conf.get('confirm_ttl', 86400):
+      revalidate(str_hash)
+    return entry['url']
+  return None
+
+def upload_file(path, str_hash, progress=None):
+  # a flight that finished just before this one started may have uploaded it
+  out = cached_url(str_hash)
+  if out:
+    return out
 
-  out = ''
-  if path.rpartition('.')[2].lower() in ['zip', 'cbz']:
-    files = azfind.extract(path)
-    if files:
-      out = upload(files, str_hash)
-      for f in files:
-        os.remove(f)
-      os.rmdir(os.path.dirname(files[0]))
-    else:
-      out = 'archive found... but empty'
+  ext = path.rpartition('.')[2].lower()
+  if azfind.is_archive(path):
+    with azfind.extract(path, archive_budget) as archive:
+      if archive.members:
+        out = upload(archive.members, str_hash, progress)
+      elif ext in ['zip', 'cbz']:
+        out = 'archive found... but empty'
+      else:
+        out = upload([path], str_hash, progress)
   else:
-    out = upload([path], str_hash)
+    out = upload_image(path, str_hash, progress)
+  return out
+
+def upload_image(path, str_hash, progress=None):
+  '''upload a single image, unless a near copy of it already was'''
+  max_distance = conf.get('phash_distance')
+  if max_distance is None or not phash.available():
+    return upload([path], str_hash, progress)
+  try:
+    value = phash.dhash(path)
+  except Exception:
+    return upload([path], str_hash, progress)
+
+  stale = 0
+  for d, other in similar.find(value, max_distance):
+    entry = images.peek(other)
+    if entry and entry.get('url'):
+      images.put(str_hash, dict(entry, phash=value))
+      similar.add(value, str_hash)
+      prune_similar(stale)
+      return entry['url']
+    stale += 1
 
-  for t in tempfiles:
-    t.close()
+  out = upload([path], str_hash, progress, {'phash':value})
+  if images.peek(str_hash, {}).get('phash') == value:
+    similar.add(value, str_hash)
+  prune_similar(stale)
   return out
 
-def confirm_img(urls):
-  for url in urls.split('\n'):
-    if url and requests.get(url, timeout=2).status_code != 200:
-      return False
-  return True
+def prune_similar(stale):
+  '''
+  rebuild similar from images once lookups keep finding hashes of dropped
+  entries, or it holds more hashes than images has entries
+  '''
+  global stale_hits
+  with similar_lock:
+    stale_hits += stale
+    if stale_hits < conf.get('phash_stale', 64) and \
+       len(similar) <= len(images) + conf.get('phash_stale', 64):
+      return
+    stale_hits = 0
+    similar.rebuild(similar_items())
+
+def single_flight(key, func, *args):
+  '''
+  run func(*args) once per key at a time
+
+  callers arriving from other threads while it runs wait for and share
+  its result (or exception) instead of repeating the work
+  '''
+  with flight_lock:
+    future = flights.get(key)
+    owner  = future is None
+    if owner:
+      future = flights[key] = Future()
+  if not owner:
+    return future.result()
+
+  try:
+    result = func(*args)
+  except BaseException as e:
+    future.set_exception(e)
+    raise
+  else:
+    future.set_result(result)
+    return result
+  finally:
+    with flight_lock:
+      flights.pop(key, None)
+
+def revalidate(str_hash):
+  if str_hash not in validating:
+    validating.add(str_hash)
+    asyncio.run_coroutine_threadsafe(validate(str_hash), loop)
+
+async def validate(str_hash):
+  try:
+    entry = images.peek(str_hash)
+    if entry and entry.get('url'):
+      if await confirm_img(entry['url']):
+        images.put(str_hash, dict(entry, checked=time.time()))
+      else:
+        images.pop(str_hash)
+  except:
+    pass # unreachable, leave it stale and try again on the next hit
+  finally:
+    validating.discard(str_hash)
+
+async def confirm_img(urls):
+  urls    = [url for url in urls.split('\n') if url]
+  results = await asyncio.gather(*[confirm_page(url) for url in urls])
+  return all(results)
+
+async def confirm_page(url):
+  client = web.get_client()
+  resp   = await client.head(url, timeout=2)
+  if resp.status == 200:
+    return True
+  # some hosts refuse HEAD (405, or 403 from signed urls), ask for one byte
+  resp = await client.get(url, timeout=5, headers={'Range':'bytes=0-0'})
+  return resp.status in (200, 206)
+
+def get_hash(path, cache=True):
+  if cache:
+    stat  = os.stat(path)
+    entry = hashes.get(path)
+    if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+      return entry[2]
 
-def get_hash(path):
-  hasher = hashlib.md5()
   with open(path, 'rb') as f:
-    buf = f.read()
-    hasher.update(buf)
+    str_hash = file_digest(f)
+
+  if cache:
+    hashes.put(path, [stat.st_size, stat.st_mtime_ns, str_hash])
+  return str_hash
+
+def file_digest(f, chunk_size=2**20):
+  if hasattr(hashlib, 'file_digest'):
+    return hashlib.file_digest(f, 'md5').hexdigest()
+  hasher = hashlib.md5()
+  buf    = bytearray(chunk_size)
+  view   = memoryview(buf)
+  while True:
+    size = f.readinto(buf)
+    if not size:
+      break
+    hasher.update(view[:size])
   return hasher.hexdigest()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import hashlib
+from cogs.utils.cache import PersistentLRUCache
+
+class TrackCache(PersistentLRUCache):
+  '''
+  ogg opus copies of played songs on disk, least recently played evicted
+
+  keys include the item's modification date, so a changed song misses.
+  shows up in .caches as 'opus tracks', its hit rate is the share of
+  songs played from disk
+  '''
+  def __init__(self, directory, max_bytes):
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+    for name in os.listdir(directory):
+      if name.endswith('.part'): # left by a restart mid song
+        os.remove(os.path.join(directory, name))
+    super(TrackCache, self).__init__(os.path.join(directory, 'index.json'),
+                                     'opus tracks', max_bytes=max_bytes,
+                                     sizeof=lambda value: value['size']
+    )
+
+  @staticmethod
+  def key(item):
+    return '{}:{}'.format(item.id, item.object_dict.get('DateModified', ''))
+
+  def path(self, key):
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.ogg'
+    return os.path.join(self.directory, name)
+
+  def open(self, key):
+    '''the cached file mapped into memory, or None on a miss'''
+    if self.get(key) is None:
+      return None
+    try:
+      with open(self.path(key), 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      self.pop(key)
+      return None
+
+  def recorder(self, key, stream):
+    return Recorder(self, key, stream)
+
+  def evict(self):
+    while self.data and (
+          (self.max_entries and len(self.data) > self.max_entries) or
+          (self.max_bytes   and self.bytes     > self.max_bytes)):
+      key, entry  = self.data.popitem(last=False)
+      self.bytes -= entry[3]
+      self.evictions += 1
+      try:
+        os.remove(self.path(key))
+      except OSError:
+        pass
+
+class Recorder:
+  '''
+  a stream that also writes what is read from it into the cache
+
+  close(keep=True) adds the file to the cache, only do that if the whole
+  stream was read
+  '''
+  def __init__(self, cache, key, stream):
+    self.cache  = cache
+    self.key    = key
+    self.stream = stream
+    self.tmp    = '{}.{}.part'.format(cache.path(key), id(self))
+    self.file   = open(self.tmp, 'wb')
+
+  def read(self, size):
+    data = self.stream.read(size)
+    if self.file:
+      self.file.write(data)
+    return data
+
+  def close(self, keep=False):
+    if not self.file:
+      return
+    self.file.close()
+    self.file = None
+    if keep:
+      path = self.cache.path(self.key)
+      os.replace(self.tmp, path)
+      self.cache.put(self.key, {'size' : os.path.getsize(path)})
+    else:
+      os.remove(self.tmp)
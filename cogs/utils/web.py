@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import time
+import json
+import asyncio
+import aiohttp
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+client = None
+
+def get_client(loop=None):
+  '''the bot wide HTTPClient, also reachable as bot.web from cogs'''
+  global client
+  if client is None:
+    client = HTTPClient(loop or asyncio.get_event_loop())
+  return client
+
+class Response:
+  __slots__ = ('status', 'headers', 'url', 'body')
+
+  def __init__(self, status, headers, url, body):
+    self.status  = status
+    self.headers = headers
+    self.url     = url
+    self.body    = body
+
+  def text(self, encoding='utf-8'):
+    return self.body.decode(encoding, 'replace')
+
+  def json(self):
+    return json.loads(self.text())
+
+class HTTPClient:
+  '''
+  pooled http for every cog
+
+  one aiohttp session keeps connections alive, caps them per host and
+  caches dns for dns_ttl seconds. blocking libraries get the same limits
+  through requests sessions sharing one mounted adapter (see mount).
+  written against aiohttp 1.0, the version discord.py 0.16 pins
+  '''
+  def __init__(self, loop, limit=64, limit_per_host=8, timeout=30,
+               dns_ttl=300):
+    self.loop           = loop
+    self.limit          = limit
+    self.limit_per_host = limit_per_host
+    self.timeout        = timeout
+    self.dns_ttl        = dns_ttl
+    self.dns_cleared    = 0
+    self.metrics        = {} # host -> {requests, errors, bytes, seconds}
+    self._connector     = None
+    self._session       = None
+    self._requests      = None
+    self.adapter        = HTTPAdapter(pool_connections=limit,
+                                      pool_maxsize=limit_per_host,
+                                      pool_block=True
+    )
+
+  @property
+  def session(self):
+    if self._session is None or self._session.closed:
+      # aiohttp 1.0 counts limit per host, and keeps dns answers forever
+      self._connector = aiohttp.TCPConnector(limit=self.limit_per_host,
+                                             use_dns_cache=True,
+                                             loop=self.loop
+      )
+      self._session    = aiohttp.ClientSession(connector=self._connector,
+                                               loop=self.loop
+      )
+      self.dns_cleared = time.time()
+    return self._session
+
+  @property
+  def requests(self):
+    '''shared requests.Session for code running in executor threads'''
+    if self._requests is None:
+      self._requests = self.mount(requests.Session())
+    return self._requests
+
+  def mount(self, session):
+    '''make a library's requests.Session use the shared pools and metrics'''
+    session.mount('http://',  self.adapter)
+    session.mount('https://', self.adapter)
+    session.hooks['response'].append(self.record_response)
+    return session
+
+  async def request(self, method, url, timeout=None, **kw):
+    '''returns a Response with the whole body read'''
+    session = self.session
+    if time.time() - self.dns_cleared > self.dns_ttl:
+      self._connector.clear_dns_cache()
+      self.dns_cleared = time.time()
+    start = time.time()
+    try:
+      out = await asyncio.wait_for(self.read(session, method, url, **kw),
+                                   timeout or self.timeout
+      )
+    except:
+      self.record(url, time.time() - start, error=True)
+      raise
+    self.record(url, time.time() - start, len(out.body), out.status >= 400)
+    return out
+
+  async def read(self, session, method, url, **kw):
+    async with session.request(method, url, **kw) as resp:
+      body = await resp.read()
+      return Response(resp.status, resp.headers, str(resp.url), body)
+
+  async def get(self, url, **kw):
+    return await self.request('GET', url, **kw)
+
+  async def head(self, url, **kw):
+    kw.setdefault('allow_redirects', True)
+    return await self.request('HEAD', url, **kw)
+
+  def record_response(self, response, *args, **kw):
+    self.record(response.url, response.elapsed.total_seconds(),
+                int(response.headers.get('Content-Length') or 0),
+                response.status_code >= 400
+    )
+
+  def record(self, url, seconds, size=0, error=False):
+    host  = urlparse(url).hostname or url
+    entry = self.metrics.setdefault(host, {
+      'requests' : 0,
+      'errors'   : 0,
+      'bytes'    : 0,
+      'seconds'  : 0.0
+    })
+    entry['requests'] += 1
+    entry['errors']   += int(error)
+    entry['bytes']    += size
+    entry['seconds']  += seconds
+
+  async def close(self):
+    if self._session:
+      await self._session.close()
+    if self._requests:
+      self._requests.close()
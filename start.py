@@ -13,6 +13,7 @@ import re, sys, os
 from cogs import *
 from cogs.utils.config import Config
 import cogs.utils.format as formatter
+from cogs.utils import web
 
 starting_cogs = [
   'cogs.general',
@@ -62,8 +63,14 @@ prefix = ['.']
 description = 'Andy29485\'s bot'
 help_attrs = dict(hidden=True)
 
-bot = commands.Bot(command_prefix=prefix, description=description,
-                   pm_help=None, help_attrs=help_attrs)
+class Bot(commands.Bot):
+  async def close(self):
+    await super(Bot, self).close()
+    await self.web.close() # runs on logout, and when run() is interrupted
+
+bot = Bot(command_prefix=prefix, description=description,
+          pm_help=None, help_attrs=help_attrs)
+bot.web = web.get_client(bot.loop)
 
 @bot.async_event
 async def on_ready():
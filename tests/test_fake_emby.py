@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+'''the emby cog against cogs.utils.fake_emby, hydrating and announcing items'''
+
+import os
+import json
+import asyncio
+import importlib
+import pytest
+
+pytest.importorskip('embypy')
+pytest.importorskip('discord')
+
+from cogs.utils import web, emby_socket
+from cogs.utils.fake_emby import FakeEmby
+
+loop = asyncio.get_event_loop()
+
+class Bot:
+  '''just what the emby cog uses of a discord bot'''
+  def __init__(self):
+    self.loop = loop
+    self.web  = web.HTTPClient(loop)
+    self.sent = []
+
+  def get_cog(self, name):
+    return None # so the cog's poll loop ends right away
+
+  def get_channel(self, chan_id):
+    return chan_id
+
+  async def send_message(self, chan, content=None, embed=None):
+    self.sent.append((chan, embed))
+
+@pytest.fixture(scope='module')
+def emby(tmpdir_factory):
+  cwd    = os.getcwd()
+  server = FakeEmby(port=0)
+  loop.run_until_complete(server.start())
+  server.put('series', 'Fake series', item_type='Series')
+  server.put('season', 'Season 1', 'series', item_type='Season')
+
+  # emby_helper and puush read their configs when they are imported
+  os.chdir(str(tmpdir_factory.mktemp('emby')))
+  os.makedirs('configs')
+  with open('configs/emby.json', 'w') as f:
+    json.dump({
+      'address'   : server.address,
+      'websocket' : False,
+      'watching'  : {'last':None, 'series':['chan']},
+      'auth'      : {'api_key':'key', 'userid':'user', 'device_id':'test'}
+    }, f)
+  with open('configs/az.json', 'w') as f:
+    json.dump({'path':'.', 'backend':'local', 'local_port':0,
+               'local_url':'http://127.0.0.1'}, f)
+  emby_helper = importlib.import_module('cogs.utils.emby_helper')
+  emby_cog    = importlib.import_module('cogs.emby')
+
+  yield server, emby_helper, emby_cog
+  loop.run_until_complete(server.stop())
+  os.chdir(cwd)
+
+def blocking(func, *args):
+  return loop.run_until_complete(loop.run_in_executor(None, func, *args))
+
+def test_hydrate_gets_items_and_their_ancestors(emby):
+  server, emby_helper, emby_cog = emby
+  server.put('ep1', 'Pilot', 'season', item_type='Episode')
+  server.put('ep2', 'Second', 'season', item_type='Episode')
+
+  hydrated = blocking(emby_helper.hydrate, ['ep2', 'missing', 'ep1'])
+  assert [(item.id, ancestors) for item, ancestors in hydrated] == [
+    ('ep2', ['season', 'series']),
+    ('ep1', ['season', 'series'])
+  ]
+
+def test_websocket_message_notifies_watching_channel(emby):
+  server, emby_helper, emby_cog = emby
+  bot = Bot()
+  cog = emby_cog.Emby(bot)
+  url = emby_socket.websocket_url(server.address, {'api_key':'key'})
+
+  async def added():
+    follow = loop.create_task(emby_socket.follow(bot.web.session, url,
+                                                 cog.on_socket_message))
+    await asyncio.sleep(0.2) # connected
+    await server.add('ep3', 'Third', 'season')
+    for i in range(50):
+      if bot.sent:
+        break
+      await asyncio.sleep(0.1)
+    follow.cancel()
+    await bot.web.close()
+
+  loop.run_until_complete(added())
+  assert len(bot.sent) == 1
+  chan, embed = bot.sent[0]
+  assert chan == 'chan'
+  assert embed.title.startswith('New item added: ')
+  assert embed.title.endswith('Third')
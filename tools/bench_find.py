@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+'''
+times find.scan against the os.walk search it replaced
+
+  python3 tools/bench_find.py [--files 1000000] [--dir /dev/shm/find_bench]
+
+a tree of --files files is generated in --dir (reused when it is already
+there, put it on tmpfs to time the walk rather than the disk), then every
+query is run through both and the results are checked to be the same
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cogs.utils import find
+
+words   = ['foo', 'bar', 'baz', 'vol', 'chapter', 'scan', 'art', 'misc']
+exts    = ['.jpg', '.png', '.zip', '.txt']
+queries = [['foo'], ['foo', '-bar'], ['jpg', '-baz', '-vol']]
+
+def name(rand):
+  return '_'.join(rand.sample(words, 2)) + str(rand.randrange(1000))
+
+def generate(directory, files, per_dir=100, fanout=10):
+  '''files spread per_dir to a directory, with a .git directory here and there'''
+  rand    = random.Random(files) # same tree for the same size
+  pending = [directory]
+  made    = 0
+  while made < files:
+    parent = pending.pop(0)
+    for i in range(fanout):
+      sub = os.path.join(parent, '{}_{}'.format(name(rand), i))
+      os.makedirs(sub)
+      pending.append(sub)
+      if rand.random() < 0.05:
+        git = os.path.join(sub, '.git')
+        os.makedirs(git)
+        open(os.path.join(git, 'foo.jpg'), 'w').close()
+      for j in range(min(per_dir, files - made)):
+        filename = '{}_{}{}'.format(name(rand), j, rand.choice(exts))
+        open(os.path.join(sub, filename), 'w').close()
+        made += 1
+
+def walk_search(directory, pattern):
+  '''the search before find.scan: os.walk, realpath and match every file'''
+  pattern = set(pattern) | {'-.git'}
+  matches = []
+  for root, directories, filenames in os.walk(directory):
+    for filename in filenames:
+      filename = os.path.realpath(os.path.join(root, filename))
+      lowered  = filename.lower()
+      for i in pattern:
+        if i[0] == '-':
+          if i[1:].lower() in lowered:
+            break
+        elif i not in lowered:
+          break
+      else:
+        matches.append(filename)
+  return matches
+
+def timed(func, *args):
+  start = time.perf_counter()
+  out   = func(*args)
+  return time.perf_counter() - start, out
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--files', type=int, default=10**6)
+  parser.add_argument('--dir', default='/dev/shm/find_bench')
+  parser.add_argument('--workers', type=int, default=None)
+  args = parser.parse_args()
+
+  directory = os.path.join(args.dir, str(args.files))
+  if not os.path.isdir(directory):
+    print('generating {} files in {}'.format(args.files, directory))
+    generate(directory, args.files)
+
+  for query in queries:
+    walked,  expected = timed(walk_search, directory, query)
+    scanned, found    = timed(find.scan, directory, find.Matcher(query),
+                                         args.workers)
+    same = sorted(expected) == sorted(found)
+    print('{:<16} os.walk {:6.1f}s  scan {:6.1f}s  {} matches{}'.format(
+          ' '.join(query), walked, scanned, len(found),
+          '' if same else '  RESULTS DIFFER'
+    ))
+
+if __name__ == '__main__':
+  main()